@@ -0,0 +1,113 @@
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from landmarks import load_landmarks
+from snapshot import load_snapshot
+from spatial import SpatialIndex
+
+# Trips sent to a worker at a time, large enough to amortise the inter process traffic
+CHUNK_SIZE = 64
+
+# Columns of the result csv of every mode
+COLUMNS = {"walk": ["row", "distance", "settled", "route"],
+           "transport": ["row", "duration", "settled", "legs"]}
+
+# Graphs of the worker process, loaded once by init_worker
+_worker = {}
+
+
+def init_worker(mode):
+    """
+    Load the graphs of a worker process
+    The snapshot arrays are memory mapped, so every worker shares the same pages instead of parsing walk.graphml
+    """
+    if mode == "walk":
+        snapshot = load_snapshot("walk.graphml")
+        index = snapshot.index()
+        index.landmarks = load_landmarks(index, "walk.graphml")
+        _worker["index"] = index
+        _worker["spatial"] = SpatialIndex(snapshot)
+    else:
+        from walk import Walk
+        from mrt import Mrt
+        from bus import Bus
+        from multimodal import MultimodalGraph
+        _worker["network"] = MultimodalGraph(Walk(), Mrt(), Bus())
+    _worker["mode"] = mode
+
+
+def route_chunk(chunk):
+    """
+    Route a chunk of (row, start_lat, start_lon, end_lat, end_lon) trips, return one result row per trip
+    An unreachable end gives an empty route
+    """
+    rows, trips = chunk
+    results = []
+    if _worker["mode"] == "walk":
+        index = _worker["index"]
+        # snap every start and end of the chunk in one call
+        points = trips.reshape(-1, 2)
+        nodes, node_distances = _worker["spatial"].nearest_nodes(points[:, 0], points[:, 1])
+        for i, row in enumerate(rows):
+            route, distance, settled = index.shortest_path(nodes[2 * i], nodes[2 * i + 1], "alt")
+            if route is None:
+                results.append([row, "", settled, ""])
+            else:
+                distance += node_distances[2 * i] + node_distances[2 * i + 1]
+                results.append([row, round(distance, 1), settled, " ".join(str(osmid) for osmid in index.ids[route])])
+    else:
+        network = _worker["network"]
+        for row, (x1, y1, x2, y2) in zip(rows, trips):
+            try:
+                itinerary = network.plan(x1, y1, x2, y2)
+            except ValueError:
+                results.append([row, "", "", ""])
+                continue
+            legs = " ".join(leg.mode if leg.service is None else leg.mode + ":" + leg.service for leg in itinerary.legs)
+            results.append([row, round(itinerary.duration, 1), itinerary.settled, legs])
+    return results
+
+
+def run_batch(trips_file, results_file, mode="walk", processes=None):
+    """
+    Route every (start_lat, start_lon, end_lat, end_lon) row of trips_file over a process pool
+    Results are written to results_file as the chunks complete, in completion order, with the row number of the trip
+    Returns the number of trips per second
+    """
+    trips = pd.read_csv(trips_file)[['start_lat', 'start_lon', 'end_lat', 'end_lon']].values.astype(np.float64)
+    rows = np.arange(len(trips))
+    chunks = [(rows[i:i + CHUNK_SIZE], trips[i:i + CHUNK_SIZE]) for i in range(0, len(trips), CHUNK_SIZE)]
+    processes = processes or os.cpu_count()
+
+    # build missing snapshots / landmark tables / bus network once here, not in every worker at the same time
+    init_worker(mode)
+
+    start = time.time()
+    done = 0
+    with open(results_file, "w", newline="") as f, \
+            multiprocessing.Pool(processes, initializer=init_worker, initargs=(mode,)) as pool:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS[mode])
+        for results in pool.imap_unordered(route_chunk, chunks):
+            writer.writerows(results)
+            done += len(results)
+            if done % (CHUNK_SIZE * 16) < len(results):
+                print(str(done) + "/" + str(len(trips)) + " trips, " +
+                      str(round(done / (time.time() - start), 1)) + " trips/s")
+    throughput = len(trips) / (time.time() - start)
+    print("Routed " + str(len(trips)) + " trips with " + str(processes) + " processes at " +
+          str(round(throughput, 1)) + " trips/s")
+    return throughput
+
+
+if __name__ == "__main__":
+    # python batch.py TRIPS.csv RESULTS.csv [walk|transport] [processes]
+    # TRIPS.csv has start_lat, start_lon, end_lat, end_lon columns
+    if len(sys.argv) < 3:
+        raise SystemExit("Usage: python batch.py TRIPS.csv RESULTS.csv [walk|transport] [processes]")
+    run_batch(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "walk",
+              int(sys.argv[4]) if len(sys.argv) > 4 else None)
@@ -1,34 +1,189 @@
 import json as js
 import folium as fo
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import networkx as nx
 import osmnx as ox
-import shapely
 import math
 import os
-import random
-import itertools
 import heapq
-from shapely.geometry import Point, LineString, Polygon
+import hashlib
+import pickle
+import time
+from busstops import BusStopRegistry
+from geography import POLYGON_FILE, load_area
+from graphindex import DATA_FOLDER
+from landmarks import load_landmarks
+from raptor import HEADWAYS_FILE, Raptor, load_headways
+from routefeatures import line_geojson, lines_geojson
+from snapshot import load_snapshot
+from spatial import SpatialIndex
 
 
+# Preprocessed bus network, bump the version when its content changes
+BUS_NETWORK_FILE = os.path.join(DATA_FOLDER, "busnetwork.pkl")
+BUS_NETWORK_VERSION = 7
+
+# Bus stop search: metres added for every change of bus service and the most transfers of a route
+TRANSFER_PENALTY = 500
+MAX_TRANSFERS = 3
+
 
 class Bus:
     featuregroup = fo.FeatureGroup(name="Bus Stop Markers")
 
     def __init__(self):
-        start_x = None
-        start_y = None
-        end_x = None
-        end_y = None
-        unique_osmid_list = None
-        route_display = None
-        lastx = None
-        lasty = None
-        firstx = None
-        firsty = None
-        featuregroup = None
+        # Route and first / last bus stop of the latest busAlgo call
+        self.route_display = None
+        self.lastx = None
+        self.lasty = None
+        self.firstx = None
+        self.firsty = None
+
+        # Everything below does not depend on the query, load it once for every busAlgo call
+        # Drive graph from its binary snapshot (data/drive.snapshot), road lines are gathered from its edge arrays
+        self.drive_snapshot = load_snapshot("drive.graphml")
+        # Drive adjacency index with its precomputed landmark table for the stop to stop road paths
+        self.drive_index = self.drive_snapshot.index()
+        self.drive_index.landmarks = load_landmarks(self.drive_index, "drive.graphml")
+        # Nearest road edge index to snap the bus stops onto the drive graph
+        self.drive_spatial = SpatialIndex(self.drive_snapshot)
+
+        # busstop_Query = '[out:json];(node["highway"="bus_stop"](1.3891,103.8872,1.4222,103.9261);>;);out;'
+        # # creating a graph with nodes and the cost of the route that is in the polygon.
+        # responsejson_Busstop = ox.overpass_request(
+        #     data={'data': busstop_Query}, timeout=180)
+        # busstop_Graph = self.create_graph(responsejson_Busstop)
+        # busstop_Graph = ox.truncate_graph_polygon(
+        #     busstop_Graph, polygon, truncate_by_edge=True, retain_all=True)
+        self.busstop_snapshot = load_snapshot("busstop.graphml")
+        self.osm_node = self.busstop_snapshot.nodes_frame()
+        # Nearest bus stop index
+        self.busstop_spatial = SpatialIndex(self.busstop_snapshot)
+
+        # Bus stops, stop sequence of every service, bus stop adjacency and bus services of every stop
+        self.load_network()
+
+    def bus_network_fingerprint(self):
+        """
+        Content hash of every local file the bus network is built from
+        """
+        files = [POLYGON_FILE, os.path.join(DATA_FOLDER, "busstop.graphml"), os.path.join(DATA_FOLDER, "drive.graphml"),
+                 HEADWAYS_FILE]
+        for folder in ('BUS/ROUTE', 'BUS/STOP'):
+            files.extend(sorted(os.path.join(folder, name) for name in os.listdir(folder)))
+        digest = hashlib.sha1()
+        for filename in files:
+            digest.update(filename.encode())
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def load_network(self, rebuild=False):
+        """
+        Load the preprocessed bus network from data/busnetwork.pkl
+        It is rebuilt from the BUS/ROUTE and BUS/STOP json files and BUS/headways.json when missing, of an older version or when any source file changed
+        """
+        fingerprint = self.bus_network_fingerprint()
+        network = None
+        if not rebuild and os.path.exists(BUS_NETWORK_FILE):
+            with open(BUS_NETWORK_FILE, 'rb') as f:
+                network = pickle.load(f)
+            if network.get('version') != BUS_NETWORK_VERSION or network.get('fingerprint') != fingerprint:
+                network = None
+        if network is None:
+            network = self.build_network()
+            network['version'] = BUS_NETWORK_VERSION
+            network['fingerprint'] = fingerprint
+            with open(BUS_NETWORK_FILE, 'wb') as f:
+                pickle.dump(network, f)
+            print("Bus network saved to " + BUS_NETWORK_FILE)
+
+        self.bus_route_ST_df = network['bus_route_ST_df']
+        self.bus_stop_ST_df = network['bus_stop_ST_df']
+        self.bus_stop_ST_code = network['bus_stop_ST_code']
+        self.bus_stop_ST_Adj = network['bus_stop_ST_Adj']
+        self.bus_stops = network['bus_stops']
+        self.raptor = network['raptor']
+        self.segments = network['segments']
+
+    def build_network(self):
+        """
+        Read every bus route and bus stop json file and build the bus network
+        Returns a dictionary of the route and stop DataFrames of every service, the bus services of every bus stop,
+        the bus stop adjacency, the bus stop registry, the RAPTOR router and the road polyline between consecutive stops
+        """
+        # Punggol area, bus routes and bus stops outside are dropped
+        area = load_area()
+
+        # Local files
+
+        bus_route_ST_df = {}
+
+        with os.scandir('BUS/ROUTE') as data_route:
+            for data_route_json in data_route:
+                try:
+                    data_route_filename = (data_route_json.name.strip(".json"))
+                    with open(data_route_json) as br:
+                        data_route = js.load(br)
+                    route_key, route_geodf = self.bus_route_json_clean(
+                        data_route, data_route_filename, area)
+                    bus_route_ST_df[route_key] = route_geodf
+                except:
+                    raise SystemExit(
+                        "Reading Bus Route Json File Error", data_route_filename)
+        print("Bus route loaded successfully")
+
+        bus_stop_ST_df = {}
+        bus_stop_ST_code = {}
+        # read in the Json file to get the  busstop  osmid and the osmid for the location
+        with os.scandir('BUS/STOP') as data_stop:
+            for data_stop_json in data_stop:
+                try:
+                    data_stop_filename = (data_stop_json.name.strip(".json"))
+                    with open(data_stop_json) as bs:
+                        data_stop = js.load(bs)
+                    stop_key, stop_geodf, bus_stop_ST_code = self.bus_stop_json_clean(
+                        data_stop, data_stop_filename, area, bus_stop_ST_code)
+                    bus_stop_ST_df[stop_key] = stop_geodf
+                except:
+                    raise SystemExit(
+                        "Reading Bus Stop Json File Error", data_stop_filename)
+        print("Bus stop loaded successfully")
+
+        bus_stops = BusStopRegistry.build(bus_stop_ST_df, self.osm_node, bus_stop_ST_code)
+        bus_stop_ST_Adj = self.create_busCode_Adj(
+            bus_stop_ST_df, bus_stops, bus_stop_ST_code)
+
+        # round based transit router over the stop sequences with the service headways of BUS/headways.json
+        raptor = Raptor.build(bus_stop_ST_df, bus_stops, load_headways())
+
+        # road polyline of every (stop, next stop) of every service, bus routes are drawn from these segments
+        segments = self.build_segments(raptor, bus_stops)
+        print("Bus road segments computed for " + str(len(segments)) + " stop pairs")
+
+        return {'bus_route_ST_df': bus_route_ST_df, 'bus_stop_ST_df': bus_stop_ST_df,
+                'bus_stop_ST_code': bus_stop_ST_code, 'bus_stop_ST_Adj': bus_stop_ST_Adj,
+                'bus_stops': bus_stops, 'raptor': raptor, 'segments': segments}
+
+    def build_segments(self, raptor, bus_stops):
+        """
+        Drive network polyline, (lon, lat) array, of every consecutive (stop code, next stop code) of every service
+        """
+        pairs = set()
+        for route in range(len(raptor.route_service)):
+            stops = bus_stops.codes[raptor.route_stops[raptor.route_offsets[route]:raptor.route_offsets[route + 1]]]
+            pairs.update(zip(stops[:-1].tolist(), stops[1:].tolist()))
+        pairs = sorted(pairs)
+        # road node of every stop, snapped in one call
+        codes = sorted(set(code for pair in pairs for code in pair))
+        road_node = dict(zip(codes, self.get_nearestedge_node(codes, bus_stops)))
+        segments = {}
+        for code, next_code in pairs:
+            rows = self.road_rows(road_node[code], road_node[next_code])
+            segments[(code, next_code)] = np.array(self.drive_snapshot.edge_line(rows))
+        return segments
 
     def get_node(self, element):
         """
@@ -182,241 +337,189 @@ class Bus:
                 G, name=attribute_name, values=attribute_values)
         return G
 
-    def bus_route_json_clean(self, data, name, polygon):
+    def bus_route_json_clean(self, data, name, area):
         """
         Read bus route json file,
-        Append the row which is within the Punggol Polygon into current Bus Service Pandas DataFrame
+        Keep the coordinates which are within the Punggol Polygon in current Bus Service Pandas DataFrame
         Return Bus Service, Bus Service GeoPandas DataFrame
         """
         key_df = name.strip("R")
-        # get the busroute by using the unique osmid to check for the correct route
-        df = gpd.GeoDataFrame(
-            columns=['osmid', 'x', 'y', 'direction', 'geometry'])
+        # load every coordinate of every direction of the busroute into columnar arrays
+        coords = [np.asarray(datajson, dtype=np.float64).reshape(-1, 2) for datajson in data]
+        direction = np.concatenate([np.full(len(coord), i + 1) for i, coord in enumerate(coords)] or [np.zeros(0, dtype=int)])
+        coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+        # clip against the punggol polygon in one vectorised pass
+        inside = area.contains(coords[:, 1], coords[:, 0])
+        x, y = coords[inside, 0], coords[inside, 1]
+        # route points are numbered with a dense counter in route order, so the ids are the same on every build
+        df = gpd.GeoDataFrame({'osmid': np.arange(1, len(x) + 1), 'x': x, 'y': y,
+                               'direction': direction[inside]},
+                              geometry=gpd.points_from_xy(x, y), crs="EPSG:4326")
         df.name = name
-        df.crs = "EPSG:4326"
-        df.set_geometry('geometry')
-        # traverse through the list of busroute data to look for the cordinated of the bussstop and the route
-        for i in range(len(data)):
-            datajson = data[i]
-            for coord in range(len(datajson)):
-                x = float(datajson[coord][0])
-                y = float(datajson[coord][1])
-                geometry = Point(x, y)
-                if geometry.within(polygon):
-                    data_df = gpd.GeoDataFrame({'osmid': random.sample(
-                        self.unique_osmid_list, 1), 'x': x, 'y': y, 'direction': i + 1, 'geometry': [geometry]})
-                    df = df.append(data_df, ignore_index=True)
         return key_df, df
 
-    def bus_stop_json_clean(self, data, name, polygon, bus_stop_ST_code):
+    def bus_stop_json_clean(self, data, name, area, bus_stop_ST_code):
         """
         Read bus stop json file,
-        Append the row which is within the Punggol Polygon into current Bus Service Pandas DataFrame
+        Keep the bus stops which are within the Punggol Polygon in current Bus Service Pandas DataFrame
         Return Bus Service, Bus Service GeoPandas DataFrame, A Dictionary of Bus Service for each bus stop code
         """
         key_df = name.strip("B")
-        df = gpd.GeoDataFrame(
-            columns=['osmid', 'x', 'y', 'direction', 'geometry', 'busCode', 'description'])
+        # traverse through the data dict once to build the columns
+        stops = [(i + 1, busstop) for i in range(len(data)) for busstop in data[str(i + 1)]]
+        x = np.array([float(busstop["Longitude"]) for i, busstop in stops], dtype=np.float64)
+        y = np.array([float(busstop["Latitude"]) for i, busstop in stops], dtype=np.float64)
+        # check if the bus stop is in the punggol area in one vectorised pass
+        inside = area.contains(y, x)
+        stops = [stop for stop, keep in zip(stops, inside) if keep]
+        bus = [int(busstop['BusStopCode']) for i, busstop in stops]
+        # the id of a bus stop is its bus stop code, the same stop has the same id in every service and on every build
+        df = gpd.GeoDataFrame({'osmid': bus, 'x': x[inside], 'y': y[inside],
+                               'direction': [i for i, busstop in stops], 'busCode': bus,
+                               'description': [str(busstop["Description"]) for i, busstop in stops]},
+                              geometry=gpd.points_from_xy(x[inside], y[inside]), crs="EPSG:4326")
         df.name = name
-        df.crs = "EPSG:4326"
-        df.set_geometry('geometry')
-        # traverse through the data dict
-        for i in range(len(data)):
-            datajson = data[str(i + 1)]
-            for busstop in range(len(datajson)):
-                x = float(datajson[busstop]["Longitude"])
-                y = float(datajson[busstop]["Latitude"])
-                stopname = str(datajson[busstop]["Description"])
-                bus = int(datajson[busstop]['BusStopCode'])
-                geometry = Point(x, y)
-                # check if the bus stop is in the punggol area, by checking back with the dictionary of busroute and busstop osmid
-                if geometry.within(polygon):
-                    data_df = gpd.GeoDataFrame({'osmid': random.sample(self.unique_osmid_list, 1), 'x': x, 'y': y,
-                                                'direction': i + 1, 'geometry': [geometry], 'busCode': bus,
-                                                'description': stopname})
-                    df = df.append(data_df, ignore_index=True)
-                    if bus not in bus_stop_ST_code:
-                        bus_stop_ST_code[bus] = [str(key_df)]
-                    else:
-                        temp = bus_stop_ST_code[bus]
-                        if key_df not in temp:
-                            temp.append(key_df)
-                            bus_stop_ST_code[bus] = temp
+        for code in bus:
+            if code not in bus_stop_ST_code:
+                bus_stop_ST_code[code] = [str(key_df)]
+            elif key_df not in bus_stop_ST_code[code]:
+                bus_stop_ST_code[code].append(key_df)
         return key_df, df, bus_stop_ST_code
 
-    def create_busCode_Adj(self, stop_df, osm_df, bus_dict):
+    def create_busCode_Adj(self, stop_df, registry, bus_dict):
         """
         Create a Bus Stop Adjacency Dictionary for each relations between each bus stops
-        X & Y Coordinates are retrieved from OSMNX data as it is more accurate, on error, coordinates from json file is retrieved instead
+        X & Y Coordinates are retrieved from the bus stop registry (OSMNX data, or the json file for stops missing in OSMNX)
         Returns a Dictionary of Relations (Graph)
         """
 
         # define a dictionary
         adj_dict = {}
         for key in stop_df:
-            current_df = (stop_df[key])
-            for i in range(current_df.index.stop - 1):
-                current_busCode, next_busCode = current_df.loc[i][
-                    'busCode'], current_df.loc[i + 1]['busCode']
-                if current_busCode not in adj_dict:
-                    try:
-                        # check from OSMX and see if there is any ajacent nodes to the current nodes
-                        current_busCode_lat = osm_df[osm_df["asset_ref"] == str(
-                            current_busCode)]['y'].values[0]
-                        current_busCode_lon = osm_df[osm_df["asset_ref"] == str(
-                            current_busCode)]['x'].values[0]
-                        next_busCode_lat = osm_df[osm_df["asset_ref"] == str(
-                            next_busCode)]['y'].values[0]
-                        next_busCode_lon = osm_df[osm_df["asset_ref"] == str(
-                            next_busCode)]['x'].values[0]
-                    except:
-
-                        # check from panddasDataframe and see if there is any ajacent nodes to the current nodes
-                        current_busCode_lat = current_df[current_df["busCode"]
-                                                         == current_busCode]['y'].values[0]
-                        current_busCode_lon = current_df[current_df["busCode"]
-                                                         == current_busCode]['x'].values[0]
-                        next_busCode_lat = current_df[current_df["busCode"]
-                                                      == next_busCode]['y'].values[0]
-                        next_busCode_lon = current_df[current_df["busCode"]
-                                                      == next_busCode]['x'].values[0]
-                    # calculate the distance between nodes using the haversine finction
-                    distance = self.haversine(
-                        current_busCode_lat, current_busCode_lon, next_busCode_lat, next_busCode_lon)
-                    current_buscode_buslist = bus_dict[current_busCode]
-                    next_buscode_buslist = bus_dict[next_busCode]
-                    common_buslist = list(
-                        set(current_buscode_buslist) & set(next_buscode_buslist))
-                    if distance != 0:
-                        for busService in common_buslist:
-                            adj_dict[current_busCode] = {
-                                (next_busCode, busService): distance}
-                else:
-                    try:
-                        # check from OSMX and see if there is any ajacent nodes to the current nodes
-                        neightbour_dict = adj_dict[current_busCode]
-                        current_busCode_lat = osm_df[osm_df["asset_ref"] == str(
-                            current_busCode)]['y'].values[0]
-                        current_busCode_lon = osm_df[osm_df["asset_ref"] == str(
-                            current_busCode)]['x'].values[0]
-                        next_busCode_lat = osm_df[osm_df["asset_ref"] == str(
-                            next_busCode)]['y'].values[0]
-                        next_busCode_lon = osm_df[osm_df["asset_ref"] == str(
-                            next_busCode)]['x'].values[0]
-                    except:
-                        # check from panddasDataframe and see if there is any ajacent nodes to the current nodes
-                        current_busCode_lat = current_df[current_df["busCode"]
-                                                         == current_busCode]['y'].values[0]
-                        current_busCode_lon = current_df[current_df["busCode"]
-                                                         == current_busCode]['x'].values[0]
-                        next_busCode_lat = current_df[current_df["busCode"]
-                                                      == next_busCode]['y'].values[0]
-                        next_busCode_lon = current_df[current_df["busCode"]
-                                                      == next_busCode]['x'].values[0]
-                        # calculate the distance between nodes using the haversine finction
-                    distance = self.haversine(
-                        current_busCode_lat, current_busCode_lon, next_busCode_lat, next_busCode_lon)
-                    current_buscode_buslist = bus_dict[current_busCode]
-                    next_buscode_buslist = bus_dict[next_busCode]
-                    common_buslist = list(
-                        set(current_buscode_buslist) & set(next_buscode_buslist))
-                    if distance != 0:
-                        for busService in common_buslist:
-                            neightbour_dict[(
-                                next_busCode, busService)] = distance
+            bus_codes = [int(code) for code in stop_df[key]['busCode'].values]
+            for current_busCode, next_busCode in zip(bus_codes[:-1], bus_codes[1:]):
+                current_busCode_lat, current_busCode_lon = registry.coords(current_busCode)
+                next_busCode_lat, next_busCode_lon = registry.coords(next_busCode)
+                # calculate the distance between nodes using the haversine finction
+                distance = self.haversine(
+                    current_busCode_lat, current_busCode_lon, next_busCode_lat, next_busCode_lon)
+                common_buslist = set(bus_dict[current_busCode]) & set(bus_dict[next_busCode])
+                if distance != 0:
+                    neightbour_dict = adj_dict.setdefault(current_busCode, {})
+                    for busService in sorted(common_buslist):
+                        neightbour_dict[(next_busCode, busService)] = distance
 
         return adj_dict
 
-    def dijkstras(self, graph, start, end, bus_stop_dict, leastxfer=False):
-        """
-        Main Algorithm for bus search
-        Using bus stop adjacency list, find the shortest distance travelled through bus codes using dijkstra
-        If leastxfer is True as a heuristic, a similar entry will be pushed with a lesser distance to prioritise least transfer for bus
-        Return a list of route
-        """
-        heapqueue = []
-        seen = {}
-        final_route = []
-        next_distance = 0
-        heapq.heappush(heapqueue, [0, None, start, None])
-        while True:
-            temp_list = heapq.heappop(heapqueue)
-            temp_distance, temp_prev, temp_curr, temp_bus = temp_list[
-                0], temp_list[1], temp_list[2], temp_list[3]
-            if temp_curr == end:
-                final_route.append([temp_curr, temp_bus])
-                bus_code = [temp_prev, temp_bus]
-                while bus_code != [None, None]:
-                    final_route.append(bus_code)
-                    bus_code = seen[bus_code[0]]
-                final_route = final_route[::-1]
-                break
-            if temp_curr in seen:
+    def dijkstras(self, graph, start, end, transfer_penalty=TRANSFER_PENALTY, max_transfers=MAX_TRANSFERS):
+        """
+        Standalone bus stop search used by busAlgo(method="dijkstra"), the web app plans with multimodal.MultimodalGraph
+        Label setting dijkstra over (bus stop, bus service, transfers) states of the bus stop adjacency list,
+        riding to the next bus stop costs the distance between them and changing bus service costs transfer_penalty metres
+        Every state is settled once and routes with more than max_transfers transfers are not explored
+        Return a list of [bus stop code, bus service to the next bus stop] from start to end,
+        the end has the bus service it is reached with, an empty list if there is no route
+        and [[start, ""]] (no bus needed) if start and end are the same bus stop
+        """
+        if start == end:
+            return [[start, ""]]
+        # entries are (cost, transfers, bus stop, bus service), ties are broken the same way on every run
+        heapqueue = [(0, 0, start, "")]
+        best = {(start, "", 0): 0}
+        parent = {(start, "", 0): None}
+        settled = set()
+        while heapqueue:
+            cost, transfers, stop, service = heapq.heappop(heapqueue)
+            state = (stop, service, transfers)
+            if state in settled:
                 continue
-            seen[temp_curr] = [temp_prev, temp_bus]
-            try:
-                for next_stop in graph[temp_curr]:
-                    temp_distance += graph[temp_curr][next_stop]
-                    heapq.heappush(
-                        heapqueue, [temp_distance, temp_curr, next_stop[0], next_stop[1]])
-                    if leastxfer:
-                        if next_stop[1] == temp_bus:
-                            temp_distance -= 99999
-                        temp_distance += graph[temp_curr][next_stop]
-                        heapq.heappush(
-                            heapqueue, [temp_distance, temp_curr, next_stop[0], next_stop[1]])
-            except:
-                pass
-        return final_route
-
-    def clean_bus_route(self, route, bus_code):
+            settled.add(state)
+            if stop == end and service:
+                # unwind the parents back to the start
+                final_route = [[stop, service]]
+                while parent[state] is not None:
+                    state, service = parent[state], state[1]
+                    final_route.append([state[0], service])
+                return final_route[::-1]
+            for (next_stop, next_service), distance in graph.get(stop, {}).items():
+                # boarding the first bus is not a transfer
+                next_transfers = transfers + (1 if service and next_service != service else 0)
+                if next_transfers > max_transfers:
+                    continue
+                next_cost = cost + distance + (transfer_penalty if next_transfers > transfers else 0)
+                next_state = (next_stop, next_service, next_transfers)
+                if next_state not in settled and next_cost < best.get(next_state, math.inf):
+                    best[next_state] = next_cost
+                    parent[next_state] = state
+                    heapq.heappush(heapqueue, (next_cost, next_transfers, next_stop, next_service))
+        return []
+
+    def clean_bus_route(self, route):
         """
         Convert a final route from dijkstra to dictionary for plotting of route on display
+        Every bus service taken lists its bus stops in travel order, the transfer bus stop is in both
         Returns route dictionary
         """
         route_dict = {}
-        busService = str(route[0][1])
-        for i in range(len(route)):
-            if busService in bus_code[route[i][0]]:
-                if str(busService) not in route_dict:
-                    route_dict[str(busService)] = [route[i][0]]
-                else:
-                    temp = route_dict[str(busService)]
-                    temp.append(route[i][0])
-            else:
-                busService = route[i][1]
+        for (stop, service), (next_stop, next_service) in zip(route[:-1], route[1:]):
+            stops = route_dict.setdefault(str(service), [stop])
+            stops.append(next_stop)
         return route_dict
 
-    def get_nearestedge_node(self, osm_id, rG, bG):
-        """
-        Using OMSNX data,
-        get the coordinates from bus stop,
-        get the nearest edge on the road,
-        return the node of either end which is nearer to bus stop
-        """
-        # with the use of osmid get the nearest node to the start and end coordinates
-        temp_y = bG.nodes.get(osm_id).get('y')
-        temp_x = bG.nodes.get(osm_id).get('x')
-        temp_nearest_edge = ox.get_nearest_edge(rG, (temp_y, temp_x))
-        temp_1 = temp_nearest_edge[0].coords[0]
-        temp_2 = temp_nearest_edge[0].coords[1]
-        temp1_x = temp_1[0]
-        temp1_y = temp_1[1]
-        # calculate the distance by calling the haversine function with the haversine formula
-        temp_1_distance = self.haversine(temp1_y, temp1_x, temp_y, temp_x)
-
-        temp2_x = temp_2[0]
-        temp2_y = temp_2[1]
-        # calculate the distance by calling the haversine function with the haversine formula
-        temp_2_distance = self.haversine(temp2_y, temp2_x, temp_y, temp_x)
-        if temp_1_distance < temp_2_distance:
-            return temp_nearest_edge[1]
-        else:
-            return temp_nearest_edge[2]
+    def busJourneys(self, x1, y1, x2, y2, depart=None):
+        """
+        Pareto optimal bus journeys by arrival time and transfers from the bus stop nearest to (x1, y1)
+        to the bus stop nearest to (x2, y2), leaving at depart (seconds after midnight, now by default)
+        Returns a list of raptor.Journey, fewest transfers first, empty if there is no bus route
+        """
+        if depart is None:
+            now = time.localtime()
+            depart = now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec
+        snapped = self.busstop_spatial.snap([(x1, y1), (x2, y2)])
+        start_busstop = self.bus_stops.code_of_osmid(int(snapped.nodes[0]))
+        end_busstop = self.bus_stops.code_of_osmid(int(snapped.nodes[1]))
+        return self.raptor.journeys(start_busstop, end_busstop, depart)
+
+    def journey_route(self, journey):
+        """
+        Convert the bus legs of a journey to the route dictionary used for plotting, in travel order
+        """
+        route_dict = {}
+        for leg in journey.legs:
+            if leg.service is not None:
+                route_dict[str(leg.service)] = list(leg.stops)
+        return route_dict
 
-    def display_busstop(self, fo_map, key, value, stop_df, osm_df, prev_coord):
+    def get_nearestedge_node(self, bus_codes, bus_stops=None):
+        """
+        Using the drive spatial index,
+        get the coordinates of every bus stop from the bus stop registry,
+        snap them all onto the nearest edge on the road in one call,
+        return for every bus stop the node of either end which is nearer to it
         """
-        Get Coordinates from OSMNX Data or PandasDataFrame and plot bus stop marker
+        bus_stops = self.bus_stops if bus_stops is None else bus_stops
+        rows = [bus_stops.row_of[int(code)] for code in bus_codes]
+        stops_y, stops_x = bus_stops.lat[rows], bus_stops.lon[rows]
+        snapped = self.drive_spatial.snap(np.column_stack((stops_y, stops_x)), edges=True)
+        edge_u = self.drive_snapshot.arrays["edge_u"][snapped.edges]
+        edge_v = self.drive_snapshot.arrays["edge_v"][snapped.edges]
+        index = self.drive_index
+        nearest = []
+        for temp_y, temp_x, u, v in zip(stops_y, stops_x, edge_u, edge_v):
+            # calculate the distance to both ends by calling the haversine function with the haversine formula
+            temp_1 = index.node_id(int(u))
+            temp_2 = index.node_id(int(v))
+            temp_1_distance = self.haversine(index.y[temp_1], index.x[temp_1], temp_y, temp_x)
+            temp_2_distance = self.haversine(index.y[temp_2], index.x[temp_2], temp_y, temp_x)
+            if temp_1_distance < temp_2_distance:
+                nearest.append(int(u))
+            else:
+                nearest.append(int(v))
+        return nearest
+
+    def display_busstop(self, fo_map, key, value, prev_coord):
+        """
+        Get Coordinates from the bus stop registry and plot bus stop marker
         Return the last bus stop code for next function call to complete the full route
         """
         if prev_coord is None:
@@ -426,196 +529,154 @@ class Bus:
                 value.insert(0, prev_coord)
         bus_route_display_list = []
 
-        # travese through the lsit for bus_code and get the coordinates deom OSMX or geopandas
+        # travese through the lsit for bus_code and get the coordinates from the registry
         for bus_code in value:
-            try:
-                try:
-                    # try get from OSMNX
-                    y = float(osm_df[osm_df['asset_ref'] ==
-                                     str(bus_code)]['x'].values[0])
-                    x = float(osm_df[osm_df['asset_ref'] ==
-                                     str(bus_code)]['y'].values[0])
-                except:
-                    # try get from PandasDataFrame
-                    y = float(stop_df[stop_df['busCode']
-                                      == bus_code]['x'].values[0])
-                    x = float(stop_df[stop_df['busCode']
-                                      == bus_code]['y'].values[0])
-                # add the busstop description and the route to the map.
-                # print the bus route in green
-                # print out the list of route and busstop by using longtitude/latitude or OSM ID
-
-                description = str(
-                    stop_df[stop_df['busCode'] == bus_code]['description'].values[0])
-
-                self.featuregroup.add_child(fo.Marker([x, y], popup="[Bus:" + str(key) + ", Code:" + str(bus_code) + "]\n" +
-                                        description, icon=fo.Icon(color='green', icon='flag')))
-
-                fo.Marker([x, y], popup="[Bus:" + str(key) + ", Code:" + str(bus_code) + "]\n" +
-                                        description, icon=fo.Icon(color='green', icon='flag')).add_to(fo_map)
-                bus_route_display_list.append(tuple([x, y]))
-            except:
-                pass
+            if bus_code not in self.bus_stops:
+                continue
+            x, y = self.bus_stops.coords(bus_code)
+            # add the busstop description and the route to the map.
+            # print the bus route in green
+            # print out the list of route and busstop by using longtitude/latitude or OSM ID
+
+            description = str(self.bus_stops.get_description(bus_code))
+
+            self.featuregroup.add_child(fo.Marker([x, y], popup="[Bus:" + str(key) + ", Code:" + str(bus_code) + "]\n" +
+                                    description, icon=fo.Icon(color='green', icon='flag')))
+
+            fo.Marker([x, y], popup="[Bus:" + str(key) + ", Code:" + str(bus_code) + "]\n" +
+                                    description, icon=fo.Icon(color='green', icon='flag')).add_to(fo_map)
+            bus_route_display_list.append(tuple([x, y]))
         prev_coord = value[len(value) - 1]
         # self.fg = feature_group
         return prev_coord
 
-    def display_busroute(self, fo_map, key, value, stop_df, osm_df, driveG, drive_df, busG):
-        """
-        Get Coordinates from OSMNX Data and plot bus stop route based on start and end bus stop
-        """
-        temp_df = pd.DataFrame(columns=drive_df.columns)
-
-        for i in range(len(value) - 1):
-            current_busstop_osmid = osm_df[osm_df['asset_ref'] == str(
-                value[i])]['osmid'].values[0]
-            next_busstop_osmid = osm_df[osm_df['asset_ref'] == str(
-                value[i + 1])]['osmid'].values[0]
-            current_busroute_osmid = self.get_nearestedge_node(
-                current_busstop_osmid, driveG, busG)
-            next_busroute_osmid = self.get_nearestedge_node(
-                next_busstop_osmid, driveG, busG)
-
-            # add node and the path if it is the shortest path calculated using dijksta algorithm
-            current_busroute_next_busroute_list = nx.shortest_path(
-                driveG, source=current_busroute_osmid, target=next_busroute_osmid)
-            for j in range(len(current_busroute_next_busroute_list) - 1):
-                current_busroute_id, next_busroute_id = current_busroute_next_busroute_list[
-                                                            j], current_busroute_next_busroute_list[j + 1]
-                temp_df = temp_df.append(drive_df[(drive_df["u"] == current_busroute_id) & (
-                        drive_df["v"] == next_busroute_id)])
-
-                # out put the bus nodes and bus route in green on the map
-        temp_gdf = gpd.GeoDataFrame(temp_df, crs="EPSG:4326", geometry='geometry')
-        busLayer = fo.GeoJson(temp_gdf, style_function=lambda x: {"color": "green", "weight": "3"}, name="BUS")
+    def display_busroute(self, fo_map, key, value):
+        """
+        Plot the road route of the bus stop codes of one bus service, return its (lon, lat) points
+        """
+        points = self.route_points(value)
+
+        # out put the bus route in green on the map
+        busLayer = self.style_layer(line_geojson(points))
         busLayer.add_to(fo_map)
-        return temp_df
+        return points
 
-    def busAlgo(self, x1, y1, x2, y2):
-        # Common startup
-        punggol = gpd.read_file('geojson/polygon-punggol.geojson')
-        polygon = punggol['geometry'].iloc[0]
+    def style_layer(self, geojson):
+        """
+        BUS layer of a bus route GeoJSON
+        """
+        return fo.GeoJson(geojson, style_function=lambda x: {"color": "green", "weight": "3"}, name="BUS")
 
-        centreCoordinate = (1.40565, 103.90665000000001)
+    def route_geojson(self, value):
+        """
+        GeoJSON of the road route of the bus stop codes of one bus service, merged into one LineString
+        """
+        return line_geojson(self.route_points(value))
 
-        self.unique_osmid_list = list(range(1, 999999))
-        random.shuffle(self.unique_osmid_list)
+    def route_points(self, value):
+        """
+        (lon, lat) of the road route through the bus stop codes of value, joined from the precomputed stop to stop segments
+        Pairs that are not consecutive stops of a service (e.g. a walk between two services) are routed on the drive graph
+        """
+        parts = []
+        for code, next_code in zip(value[:-1], value[1:]):
+            segment = self.segments.get((int(code), int(next_code)))
+            if segment is None:
+                start, end = self.get_nearestedge_node([code, next_code])
+                segment = self.drive_snapshot.edge_line(self.road_rows(start, end))
+            # the segments of a route meet at the road node of their shared stop
+            if parts and len(parts[-1]) and len(segment) and np.array_equal(parts[-1][-1], segment[0]):
+                segment = segment[1:]
+            parts.append(segment)
+        return np.concatenate(parts) if parts else np.zeros((0, 2))
+
+    def road_rows(self, start, end):
+        """
+        Rows of the drive edges of the shortest road path between two road node osmids, in travel order
+        """
+        # shortest path calculated using A* with landmarks on the drive index
+        route_ids, distance, settled = self.drive_index.shortest_path(
+            self.drive_index.node_id(start), self.drive_index.node_id(end), "alt")
+        if route_ids is None:
+            return np.zeros(0, dtype=np.int64)
+        rows = self.drive_index.edge_rows_between(route_ids)
+        return rows[rows >= 0]
+
+    def busAlgo(self, x1, y1, x2, y2, method="raptor", depart=None):
+        """
+        Standalone bus only route (RAPTOR or the dijkstra bus stop search) drawn as a folium FeatureGroup,
+        for scripts and notebooks, the web app and main.py plan with multimodal.MultimodalGraph
+        Raises ValueError if there is no bus route
+        """
+        # New marker group for every query so markers of earlier routes are not carried over
+        self.featuregroup = fo.FeatureGroup(name="Bus Stop Markers")
 
         start_coord = (x1, y1)
         end_coord = (x2, y2)
 
-        # display the map that is zoomed in to the area of punggol
-        pm = fo.Map(location=centreCoordinate,
-                    zoom_start=15, control_scale=True)
+        # markers and road routes of every bus service are collected on a layer group, no full map is built
+        pm = fo.FeatureGroup(name="Bus Route")
         fo.Marker(start_coord, popup="start", icon=fo.Icon(
             color='red', icon='info-sign')).add_to(pm)
         fo.Marker(end_coord, popup="end", icon=fo.Icon(
             color='red', icon='info-sign')).add_to(pm)
 
-        # Query
-        driveGraph = ox.save_load.load_graphml("drive.graphml")
-        drive_Node, drive_Edge = ox.graph_to_gdfs(driveGraph)
-
-        # busstop_Query = '[out:json];(node["highway"="bus_stop"](1.3891,103.8872,1.4222,103.9261);>;);out;'
-        # # creating a graph with nodes and the cost of the route that is in the polygon.
-        # responsejson_Busstop = ox.overpass_request(
-        #     data={'data': busstop_Query}, timeout=180)
-        # busstop_Graph = self.create_graph(responsejson_Busstop)
-        # busstop_Graph = ox.truncate_graph_polygon(
-        #     busstop_Graph, polygon, truncate_by_edge=True, retain_all=True)
-        busstop_Graph = ox.save_load.load_graphml("busstop.graphml")
-        osm_node, notused = ox.graph_to_gdfs(busstop_Graph)
-
-        # Local files
-
-        bus_route_ST_df = {}
-        bus_route_ST_g = {}
-
-        with os.scandir('BUS/ROUTE') as data_route:
-            for data_route_json in data_route:
-                try:
-                    data_route_filename = (data_route_json.name.strip(".json"))
-                    with open(data_route_json) as br:
-                        data_route = js.load(br)
-                    route_key, route_geodf = self.bus_route_json_clean(
-                        data_route, data_route_filename, polygon)
-                    bus_route_ST_df[route_key] = route_geodf
-                    route_graph = self.node_to_graph(route_geodf)
-                    bus_route_ST_g[route_key] = route_graph
-                except:
-                    raise SystemExit(
-                        "Reading Bus Route Json File Error", data_route_filename)
-        print("Bus route loaded successfully")
-
-        bus_stop_ST_df = {}
-        bus_stop_ST_g = {}
-        bus_stop_ST_code = {}
-        # read in the Json file to get the  busstop  osmid and the osmid for the location
-        with os.scandir('BUS/STOP') as data_stop:
-            for data_stop_json in data_stop:
-                try:
-                    data_stop_filename = (data_stop_json.name.strip(".json"))
-                    with open(data_stop_json) as bs:
-                        data_stop = js.load(bs)
-                    stop_key, stop_geodf, bus_stop_ST_code = self.bus_stop_json_clean(
-                        data_stop, data_stop_filename, polygon, bus_stop_ST_code)
-                    bus_stop_ST_df[stop_key] = stop_geodf
-                    stop_graph = self.node_to_graph(stop_geodf)
-                    bus_stop_ST_g[stop_key] = stop_graph
-                except:
-                    raise SystemExit(
-                        "Reading Bus Stop Json File Error", data_stop_filename)
-        print("Bus stop loaded successfully")
+        bus_stops = self.bus_stops
+        bus_stop_ST_Adj = self.bus_stop_ST_Adj
 
         # Code the  start and end cordinates adn using osm  to look for the nearest  node  to take the  bus.
 
-        busstop_start_osm = ox.geo_utils.get_nearest_node(
-            busstop_Graph, start_coord)
-        busstop_end_osm = ox.geo_utils.get_nearest_node(
-            busstop_Graph, end_coord)
-
-        start_busstop = int(osm_node[osm_node['osmid'] ==
-                                     busstop_end_osm]["asset_ref"].values[0])
-        end_busstop = int(osm_node[osm_node['osmid'] ==
-                                   busstop_start_osm]["asset_ref"].values[0])
-
-        bus_stop_ST_Adj = self.create_busCode_Adj(
-            bus_stop_ST_df, osm_node, bus_stop_ST_code)
-        # call dijkstras to search for the shortest bus  route  for the user
-        route = self.dijkstras(bus_stop_ST_Adj, start_busstop, end_busstop,
-                               bus_stop_ST_code, leastxfer=False)
-        # print(route)
-        self.route_display = self.clean_bus_route(route, bus_stop_ST_code)
+        self.route_display = None
+        if method == "raptor":
+            # earliest arrival journey, the last of the Pareto optimal journeys
+            journeys = self.busJourneys(x1, y1, x2, y2, depart)
+            if not journeys:
+                raise ValueError("No bus route found")
+            self.route_display = self.journey_route(journeys[-1])
+        else:
+            snapped = self.busstop_spatial.snap([start_coord, end_coord])
+            busstop_start_osm = int(snapped.nodes[0])
+            busstop_end_osm = int(snapped.nodes[1])
+
+            start_busstop = bus_stops.code_of_osmid(busstop_start_osm)
+            end_busstop = bus_stops.code_of_osmid(busstop_end_osm)
+
+            # call dijkstras to search for the shortest bus  route  for the user
+            route = self.dijkstras(bus_stop_ST_Adj, start_busstop, end_busstop)
+            if not route:
+                raise ValueError("No bus route found")
+            self.route_display = self.clean_bus_route(route)
+
+        layer = self.route_layer(pm, self.route_display)
+        if not self.route_display:
+            # same bus stop at both ends or walking is faster than every bus, no bus is needed
+            self.firstx, self.firsty = x1, y1
+            self.lastx, self.lasty = x1, y1
+            return layer
+        # getting the first and the last bus stop
+        legs = list(self.route_display.values())
+        firstBusStop, actualLast = legs[0][0], legs[-1][-1]
+        self.firstx, self.firsty = bus_stops.coords(firstBusStop)
+        self.lastx, self.lasty = bus_stops.coords(actualLast)
+        return layer
 
+    def route_layer(self, fo_map, route_display):
+        """
+        Plot the bus stops of every bus service taken and return the BUS layer of the road route
+        route_display = {bus service: [bus stop codes in travel order]}
+        """
         prev_coord = None
 
         # display the  busstop route and the nodes that the bus will go to
-        df = []
-        for bus in self.route_display:
+        lines = []
+        for bus in route_display:
             prev_coord = self.display_busstop(
-                pm, bus, self.route_display[bus], bus_stop_ST_df[str(bus)], osm_node, prev_coord)
-            df.append(self.display_busroute(pm, bus, self.route_display[bus], bus_stop_ST_df[str(
-                bus)], osm_node, driveGraph, drive_Edge, busstop_Graph))
-            print("\nBus taken:")
-            print(bus, self.route_display[bus])
-            print("\n")
-            # getting the first bus stop
-            firstBusStop = self.route_display[bus][-1]
-
-            self.firstx = osm_node[osm_node["asset_ref"] == str(firstBusStop)]['y'].values[0]
-            self.firsty = osm_node[osm_node["asset_ref"] == str(firstBusStop)]['x'].values[0]
-        # getting the last bus stop
-        busSvc = next(iter(self.route_display))
-        actualLast = self.route_display[busSvc][0]
-        self.lastx = osm_node[osm_node["asset_ref"] == str(actualLast)]['y'].values[0]
-        self.lasty = osm_node[osm_node["asset_ref"] == str(actualLast)]['x'].values[0]
-        results = pd.concat(df)
-        all_gdf = gpd.GeoDataFrame(results, crs="EPSG:4326", geometry='geometry')
-        layer = fo.GeoJson(all_gdf, style_function=lambda x: {"color": "green", "weight": "3"}, name="BUS")
-        return layer
+                fo_map, bus, route_display[bus], prev_coord)
+            lines.append(self.display_busroute(fo_map, bus, route_display[bus]))
+        return self.style_layer(lines_geojson(lines))
 
     def getRoute(self):
-        if self.route_display is None:
+        if not self.route_display:
             return 0
         else:
             return 1
@@ -642,3 +703,8 @@ class Bus:
 # y2 = 103.909050
 # buspm = bus.busAlgo(x1,y1,x2,y2)
 # buspm.save("bus.html")
+
+
+if __name__ == "__main__":
+    # Build step: python bus.py rebuilds data/busnetwork.pkl
+    Bus().load_network(rebuild=True)
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class BusStopRegistry:
+    """
+    Single lookup table of every bus stop keyed by BusStopCode
+    Holds latitude / longitude, osmid of the OSM bus stop node (-1 if none), description and the bus services of every stop
+    Coordinates are taken from OSM data as it is more accurate, the json file coordinates are used for stops missing in OSM
+    """
+
+    def __init__(self, codes, lat, lon, osmid, description, services, osm_codes):
+        self.codes = np.asarray(codes, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.osmid = np.asarray(osmid, dtype=np.int64)
+        self.description = list(description)
+        self.services = [list(service) for service in services]
+        # BusStopCode -> row
+        self.row_of = {code: row for row, code in enumerate(self.codes.tolist())}
+        # OSM osmid -> BusStopCode of every OSM bus stop node
+        self.osm_codes = dict(osm_codes)
+
+    @classmethod
+    def build(cls, stop_df, osm_df, bus_dict):
+        """
+        Build the registry from the bus stop DataFrame of every service, the OSM bus stop nodes
+        and the dictionary of bus services of every bus stop code
+        """
+        stops = {}
+        osm_codes = {}
+        # bus stops of the json files, first occurrence of every code
+        for key in stop_df:
+            for row in stop_df[key].itertuples():
+                if int(row.busCode) not in stops:
+                    stops[int(row.busCode)] = [row.y, row.x, -1, row.description]
+        # OSM bus stop nodes with a numeric asset_ref (the bus stop code)
+        for osmid, ref, y, x, name in zip(osm_df['osmid'], osm_df['asset_ref'], osm_df['y'], osm_df['x'], osm_df['name']):
+            if ref is None or not str(ref).isdigit():
+                continue
+            code = int(ref)
+            osm_codes[int(osmid)] = code
+            if code not in stops:
+                stops[code] = [y, x, osmid, name if name is not None else ""]
+            elif stops[code][2] == -1:
+                # first OSM node of the code wins
+                stops[code][:3] = [y, x, osmid]
+
+        codes = sorted(stops)
+        return cls(codes, [stops[code][0] for code in codes], [stops[code][1] for code in codes],
+                   [stops[code][2] for code in codes], [stops[code][3] for code in codes],
+                   [bus_dict.get(code, []) for code in codes], osm_codes)
+
+    def __contains__(self, code):
+        return int(code) in self.row_of
+
+    def __len__(self):
+        return len(self.codes)
+
+    def coords(self, code):
+        """
+        Return (latitude, longitude) of a bus stop code
+        """
+        row = self.row_of[int(code)]
+        return self.lat[row], self.lon[row]
+
+    def get_osmid(self, code):
+        return int(self.osmid[self.row_of[int(code)]])
+
+    def get_description(self, code):
+        return self.description[self.row_of[int(code)]]
+
+    def get_services(self, code):
+        return self.services[self.row_of[int(code)]]
+
+    def code_of_osmid(self, osmid):
+        """
+        Return the bus stop code of an OSM bus stop node
+        """
+        return self.osm_codes[int(osmid)]
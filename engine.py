@@ -0,0 +1,98 @@
+import copy
+import hashlib
+import os
+from walk import Walk
+from mrt import LRT_DWELL, LRT_HEADWAY, LRT_SPEED, LRT_TABLE_VERSION, Mrt, lrt_table_fingerprint
+from bus import BUS_NETWORK_VERSION, Bus
+from main import transportMap, transportRoute
+from matrix import time_matrix
+from multimodal import WALK_SPEED, MultimodalGraph
+from graphindex import DATA_FOLDER
+from routecache import RouteCache
+from walkonly import walkOnlyMap, walkOnlyRoute
+
+# Bump when the searches, their costs (e.g. the wait model) or the cached route format change,
+# cached routes of an older version are ignored
+CACHE_VERSION = 2
+
+
+class RoutingEngine:
+    """
+    Long-lived routing engine, created once when the flask server starts
+    Holds the loaded walk, drive, bus stop and mrt graphs, the bus adjacency and the mrt tables in memory
+    so that every request only pays for the search itself
+    """
+
+    def __init__(self):
+        self.walk = Walk()
+        self.mrt = Mrt()
+        self.bus = Bus()
+        # Walk, LRT and bus in one graph, searched once per transport route
+        self.network = MultimodalGraph(self.walk, self.mrt, self.bus)
+        # Routes of the same snapped start and end are reused, kept on disk across restarts of the same graphs
+        self.cache = RouteCache(folder=os.path.join(DATA_FOLDER, "routecache"), namespace=self.graph_version())
+        self.walk.cache = self.cache
+        self.network.cache = self.cache
+        print("Routing engine loaded successfully")
+
+    def graph_version(self):
+        """
+        Hash of the graphml files, the bus network and LRT sources, the artifact versions, the travel time constants
+        and CACHE_VERSION, cached routes of other versions are ignored
+        """
+        digest = hashlib.sha1(self.bus.bus_network_fingerprint().encode())
+        digest.update(lrt_table_fingerprint().encode())
+        digest.update(repr((CACHE_VERSION, BUS_NETWORK_VERSION, LRT_TABLE_VERSION,
+                            WALK_SPEED, LRT_SPEED, LRT_DWELL, LRT_HEADWAY)).encode())
+        for filename in ("walk.graphml", "drive.graphml", "mrt.graphml"):
+            digest.update(str(os.path.getmtime(os.path.join(DATA_FOLDER, filename))).encode())
+        return digest.hexdigest()
+
+    def walkMap(self, start_lat, start_long, end_lat, end_long, filename):
+        """
+        Folium map of the walking only route, also saved as filename unless it is None
+        """
+        # Shallow copies share the loaded graphs but keep the per-query state (start, end, last stop...) apart
+        return walkOnlyMap(copy.copy(self.walk), start_lat,
+                           start_long, end_lat, end_long, filename)
+
+    def transportMap(self, start_lat, start_long, end_lat, end_long, filename):
+        """
+        Folium map of the route using walk, mrt and bus, also saved as filename unless it is None
+        """
+        return transportMap(copy.copy(self.walk), copy.copy(self.mrt), copy.copy(self.bus), self.network,
+                            start_lat, start_long, end_lat, end_long, filename=filename)
+
+    def walkRoute(self, start_lat, start_long, end_lat, end_long):
+        """
+        Compact payload of the walking only route, see routefeatures
+        """
+        return walkOnlyRoute(copy.copy(self.walk), start_lat, start_long, end_lat, end_long)
+
+    def transportRoute(self, start_lat, start_long, end_lat, end_long, depart=None):
+        """
+        Compact payload of the route using walk, mrt and bus, see routefeatures
+        depart = seconds after midnight, only the bus services running then are taken, None for every service
+        """
+        return transportRoute(copy.copy(self.walk), copy.copy(self.mrt), copy.copy(self.bus), self.network,
+                              start_lat, start_long, end_lat, end_long, depart)
+
+    def routeFeatures(self, start_lat, start_long, end_lat, end_long, depart=None):
+        """
+        Payloads of the walking only route and of the transport route of one request,
+        nothing is written to templates so that concurrent requests never see each other's routes
+        """
+        return {"walk": self.walkRoute(start_lat, start_long, end_lat, end_long),
+                "transport": self.transportRoute(start_lat, start_long, end_lat, end_long, depart)}
+
+    def cacheStats(self):
+        """
+        Hit / miss counters of the route cache
+        """
+        return self.cache.stats()
+
+    def walkMatrix(self, origins, destinations):
+        """
+        N x M walking time in seconds between two lists of (lat, lon), see matrix.distance_matrix
+        """
+        return time_matrix(self.walk.index, self.walk.spatial, origins, destinations)
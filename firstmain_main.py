@@ -1,58 +1,103 @@
 import os
-from flask import Flask, render_template, url_for, json, request,current_app as app, jsonify
-import pandas as pd
+import time
+from flask import Flask, render_template, request, jsonify, abort
 from geopy.geocoders import Nominatim
 from Forms import Locations
-from subprocess import Popen
+from engine import RoutingEngine
+from gazetteer import Gazetteer, Geocoder
+from geography import load_area
+from jobs import JobQueue, QueueFull
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'fba483ff5f287007f4994b0b7ec9366c'
 
+# Load every graph once at startup, the views call the engine directly instead of starting new python processes
+engine = RoutingEngine()
+
+# Place names of the bus stops, LRT stations and HDB blocks answer most lookups without a network call,
+# Nominatim is only asked (once, the answers are cached on disk) for the other names
+nom = Nominatim(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36")
+gazetteer = Gazetteer.build(engine.mrt, engine.bus)
+geocoder = Geocoder(gazetteer, nom)
+
+# Punggol area, places outside it are refused before any routing
+area = load_area()
+
+# Routes are computed on a small bounded pool, the page returns at once and polls /jobs/<id> for its routes
+jobs = JobQueue()
+
+
+def route_job(start_point, end_point):
+    """
+    Geocode both place names and compute the walking only and transport routes of a request
+    """
+    start, end = geocoder.geocode_many([start_point, end_point])
+    if start is None or end is None:
+        raise ValueError("Location not found: " + (start_point if start is None else end_point))
+    for point, location in ((start_point, start), (end_point, end)):
+        if not area.contains_point(*location):
+            raise ValueError("Location outside Punggol: " + point)
+    # only the bus services running now are taken
+    now = time.localtime()
+    return engine.routeFeatures(start[0], start[1], end[0], end[1], now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec)
+
+
 @app.route('/', methods=['GET','POST'])
 def home():
-    nom = Nominatim(user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36")
     form = Locations()
 
     refresh_count = 0 # to check times refreshed 
 
     if form.validate_on_submit():
         refresh_count += 1
-        #get start lat and long from location name using geocoder
-        n = nom.geocode(form.start_point.data, "Singapore")
-        start_lat = n.latitude
-        start_long = n.longitude
-
-        #get end lat and long from location name using geocoder
-        n = nom.geocode(form.end_point.data, "Singapore")
-        end_lat = n.latitude
-        end_long = n.longitude
-
-        #define shell commands to run python code generating maps 
-        walk_command = "python walkonly.py " + str(start_lat) + " " + str(start_long) + " " + str(end_lat) + " " + str(end_long)
-        transport_command = "python main.py " + str(start_lat) + " " + str(start_long) + " " + str(end_lat) + " " + str(end_long)
-
-        #run shell commands
-        commands = [walk_command, transport_command]
-        procs = [ Popen(i) for i in commands ]
-        for p in procs:
-            p.wait()
-
-        return render_template("gui.html", start_lat=start_lat, start_long=start_long, end_lat=end_lat, end_long=end_long, form=form, refresh_count=refresh_count)
+        #geocode and route on the job queue, the routes are fetched by the page once ready
+        try:
+            job_id = jobs.submit(route_job, form.start_point.data, form.end_point.data)
+        except QueueFull as e:
+            return render_template("gui.html", form=form, refresh_count=0, error=str(e)), 503
+        return render_template("gui.html", form=form, refresh_count=refresh_count, job_id=job_id)
     else:
         return render_template("gui.html", form=form, refresh_count=refresh_count)
 
-@app.route('/walk')
-def walking_map():
-    return render_template("walkonly.html", title="walk")
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = jobs.status(job_id)
+    if status is None:
+        abort(404)
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/<mode>')
+def job_route(job_id, mode):
+    routes = jobs.result(job_id)
+    if routes is None or mode not in routes:
+        abort(404)
+    return jsonify(routes[mode])
 
-@app.route('/transport')
-def transport_map():
-    return render_template("transport.html", title="transport")
+@app.route('/map')
+def route_map():
+    # static base map, draws the route of ?job=<id>&mode=<walk|transport> if given
+    return render_template("map.html", job_id=request.args.get('job'), mode=request.args.get('mode'))
 
 @app.route('/clean')
 def clean_map():
-    return render_template("clean.html", title="clean_map")
+    # the base map without a route
+    return render_template("map.html", title="clean_map")
+
+@app.route('/suggest')
+def suggest():
+    return jsonify(gazetteer.suggest(request.args.get('q', '')))
+
+@app.route('/cache')
+def cache_stats():
+    return jsonify(engine.cacheStats())
+
+@app.route('/jobs')
+def job_stats():
+    return jsonify(jobs.stats())
 
 
 if __name__ == "__main__":
-    app.run(host="127.0.0.1", port=5000, debug=True)
+    # debug only with FLASK_DEBUG=1, never with the reloader: it imports this module twice and would load
+    # the routing engine, the gazetteer and the job workers twice
+    app.run(host="127.0.0.1", port=5000, debug=os.environ.get("FLASK_DEBUG") == "1", use_reloader=False,
+            threaded=True)
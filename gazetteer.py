@@ -0,0 +1,184 @@
+import bisect
+import difflib
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import geopandas as gpd
+from graphindex import DATA_FOLDER
+
+# HDB blocks of Punggol
+HDB_FILE = 'geojson/hdb.geojson'
+
+# Persistent cache of the remote geocoder answers
+GEOCODE_CACHE_FILE = os.path.join(DATA_FOLDER, "geocode.json")
+
+# Lowest difflib ratio accepted by the fuzzy lookup
+FUZZY_CUTOFF = 0.8
+
+# Shortest query answered by the prefix lookup
+MIN_PREFIX = 3
+# Places of a name and of the longer names starting with it within this many metres are the same place
+# (e.g. "soo teck", "soo teck stn" and "soo teck stn exit a")
+SAME_PLACE = 200
+
+# Same spelling for the usual abbreviations of the bus stop descriptions and addresses
+ABBREVIATIONS = {"block": "blk", "station": "stn", "interchange": "int", "street": "st", "avenue": "ave",
+                 "road": "rd", "drive": "dr", "place": "pl", "central": "ctrl", "opposite": "opp",
+                 "before": "bef", "after": "aft", "primary": "pr", "secondary": "sec", "school": "sch"}
+
+
+def normalise(text):
+    """
+    Lower case, drop punctuation and "singapore", use the abbreviation of every word
+    """
+    words = re.sub(r"[^a-z0-9]+", " ", str(text).lower()).split()
+    return " ".join(ABBREVIATIONS.get(word, word) for word in words if word != "singapore")
+
+
+def distance(a, b):
+    """
+    Approximate distance in metres between two (lat, lon), equirectangular at the latitude of Singapore
+    """
+    return math.hypot(a[0] - b[0], (a[1] - b[1]) * math.cos(math.radians(1.4))) * 111195
+
+
+class Gazetteer:
+    """
+    In memory index of the place names of Punggol (bus stops, LRT stations, HDB blocks) to (lat, lon)
+    Lookup tries the exact name, then the shortest name starting with the query, then the closest name
+    A name or prefix shared by places far apart (e.g. "blk 128" of several streets) is ambiguous and not answered
+    """
+
+    def __init__(self, places):
+        # normalised name -> (lat, lon), the first place of a name wins
+        self.places = {}
+        for name, lat, lon in places:
+            key = normalise(name)
+            if key and key not in self.places:
+                self.places[key] = (float(lat), float(lon))
+        self.names = sorted(self.places)
+        # names which are also the first words of names of other places, e.g. "blk 128" and "blk 128 rivervale st"
+        self.ambiguous = set(name for name in self.names if not self.same_place(self.starting_with(name + " ") + [name]))
+
+    @classmethod
+    def build(cls, mrt, bus, hdb_file=HDB_FILE):
+        """
+        Collect the names of the loaded Mrt and Bus objects and of the HDB blocks
+        """
+        places = []
+        # LRT stations, e.g. "Soo Teck" and "Soo Teck Station"
+        stations = mrt.stations
+        for name, lat, lon in zip(stations.names, stations.lat, stations.lon):
+            places.extend([(name + " stn", lat, lon), (name, lat, lon)])
+        # bus stops by description and by bus stop code
+        registry = bus.bus_stops
+        for code, description, lat, lon in zip(registry.codes, registry.description, registry.lat, registry.lon):
+            places.extend([(description, lat, lon), (str(code), lat, lon)])
+        # HDB blocks by "blk 128 rivervale st", "128 rivervale st", postal code and building name
+        hdb = gpd.read_file(hdb_file)
+        points = hdb['geometry'].representative_point()
+        for lat, lon, number, street, postcode, name in zip(points.y, points.x, hdb['addr:housenumber'], hdb['addr:street'],
+                                                            hdb['addr:postcode'], hdb['name']):
+            if isinstance(number, str) and isinstance(street, str):
+                places.extend([("blk " + number + " " + street, lat, lon), (number + " " + street, lat, lon)])
+            if isinstance(postcode, str):
+                places.append((postcode, lat, lon))
+            if isinstance(name, str):
+                places.append((name + " " + street if isinstance(street, str) else name, lat, lon))
+        return cls(places)
+
+    def __len__(self):
+        return len(self.names)
+
+    def starting_with(self, prefix):
+        """
+        Names starting with prefix, they are next to each other in the sorted names
+        """
+        return self.names[bisect.bisect_left(self.names, prefix):bisect.bisect_left(self.names, prefix + "\x7f")]
+
+    def same_place(self, names):
+        """
+        True if all the names are within SAME_PLACE metres of the shortest one
+        """
+        first = self.places[min(names, key=len)]
+        return all(distance(first, self.places[name]) <= SAME_PLACE for name in names)
+
+    def lookup(self, query):
+        """
+        Return (lat, lon) of a place name, None if there is no close enough name or the name is ambiguous,
+        the geocoder then asks its cache and the remote geocoder
+        """
+        key = normalise(query)
+        if not key:
+            return None
+        if key in self.places:
+            return None if key in self.ambiguous else self.places[key]
+        # a prefix is only answered if it is long enough and all the names starting with it are one place
+        matches = self.starting_with(key)
+        if matches:
+            if len(key) < MIN_PREFIX or not self.same_place(matches):
+                return None
+            return self.places[min(matches, key=len)]
+        close = difflib.get_close_matches(key, self.names, n=1, cutoff=FUZZY_CUTOFF)
+        return self.places[close[0]] if close else None
+
+    def suggest(self, prefix, limit=5):
+        """
+        Up to limit names starting with prefix, shortest first
+        """
+        return sorted(self.starting_with(normalise(prefix)), key=len)[:limit]
+
+
+class Geocoder:
+    """
+    Resolve place names with the gazetteer first, then a persistent cache of the remote geocoder, then the remote geocoder
+    remote is a geopy geocoder (e.g. Nominatim), only called for names that are not in the gazetteer or the cache
+    """
+
+    def __init__(self, gazetteer, remote=None, cache_file=GEOCODE_CACHE_FILE):
+        self.gazetteer = gazetteer
+        self.remote = remote
+        self.cache_file = cache_file
+        self.cache = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.cache = json.load(f)
+        self.lock = threading.Lock()
+
+    def geocode(self, query):
+        """
+        Return (lat, lon) of a place name, None if it cannot be found
+        """
+        location = self.gazetteer.lookup(query)
+        if location is not None:
+            return location
+        key = normalise(query)
+        with self.lock:
+            if key in self.cache:
+                return tuple(self.cache[key]) if self.cache[key] else None
+        if self.remote is None:
+            return None
+        answer = self.remote.geocode(query + ", Singapore")
+        location = None if answer is None else (answer.latitude, answer.longitude)
+        with self.lock:
+            self.cache[key] = location
+            # write then rename so the cache file is never left half written
+            with open(self.cache_file + ".tmp", "w") as f:
+                json.dump(self.cache, f)
+            os.replace(self.cache_file + ".tmp", self.cache_file)
+        return location
+
+    def geocode_many(self, queries):
+        """
+        Geocode several place names at once, the names missing in the gazetteer are looked up concurrently
+        """
+        locations = [self.gazetteer.lookup(query) for query in queries]
+        missing = [i for i, location in enumerate(locations) if location is None]
+        if missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                for i, location in zip(missing, executor.map(self.geocode, [queries[i] for i in missing])):
+                    locations[i] = location
+        return locations
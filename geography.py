@@ -0,0 +1,77 @@
+import functools
+import numpy as np
+import geopandas as gpd
+import shapely
+from shapely.geometry import Point
+from shapely.prepared import prep
+from graphindex import EARTH_RADIUS
+
+# Punggol Polygon
+POLYGON_FILE = 'geojson/polygon-punggol.geojson'
+
+
+class Area:
+    """
+    Study area polygon with a prepared geometry for repeated point in polygon tests
+    Points are (lat, lon) like the spatial index, the polygon is in (lon, lat)
+    Bounding boxes are kept in degrees and projected to metres around the centre of the area (equirectangular)
+    """
+
+    def __init__(self, polygon):
+        self.polygon = polygon
+        self.prepared = prep(polygon)
+        if hasattr(shapely, "prepare"):
+            # shapely 2 vectorised tests use the geometry prepared in place
+            shapely.prepare(self.polygon)
+        # (min lon, min lat, max lon, max lat)
+        self.bounds = polygon.bounds
+        # metres per degree of longitude / latitude around the centre of the area
+        lat0 = np.radians((self.bounds[1] + self.bounds[3]) / 2)
+        self.kx = np.radians(1) * EARTH_RADIUS * np.cos(lat0)
+        self.ky = np.radians(1) * EARTH_RADIUS
+        # (min x, min y, max x, max y) in metres
+        self.projected_bounds = (float(self.bounds[0] * self.kx), float(self.bounds[1] * self.ky),
+                                 float(self.bounds[2] * self.kx), float(self.bounds[3] * self.ky))
+
+    def project(self, lat, lon):
+        """
+        Project latitude / longitude arrays to metres
+        """
+        return np.asarray(lon, dtype=np.float64) * self.kx, np.asarray(lat, dtype=np.float64) * self.ky
+
+    def in_bounds(self, lat, lon, margin=0):
+        """
+        Vectorised bounding box test of coordinate arrays, margin in metres around the box
+        """
+        x, y = self.project(lat, lon)
+        min_x, min_y, max_x, max_y = self.projected_bounds
+        return (x >= min_x - margin) & (x <= max_x + margin) & (y >= min_y - margin) & (y <= max_y + margin)
+
+    def contains(self, lat, lon):
+        """
+        Vectorised point in polygon test of coordinate arrays, returns a boolean array
+        Same result as Point(lon, lat).within(polygon) for every point, points outside the bounding box are not tested
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        inside = self.in_bounds(lat, lon)
+        if hasattr(shapely, "contains_xy"):
+            inside[inside] = shapely.contains_xy(self.polygon, lon[inside], lat[inside])
+        else:
+            # shapely < 2
+            inside[inside] = [self.prepared.contains(Point(x, y)) for x, y in zip(lon[inside], lat[inside])]
+        return inside
+
+    def contains_point(self, lat, lon):
+        """
+        Return True if (lat, lon) is in the area
+        """
+        return bool(self.contains(lat, lon)[0])
+
+
+@functools.lru_cache(maxsize=None)
+def load_area(filename=POLYGON_FILE):
+    """
+    Area of the first polygon of a geojson file, read once and shared by every caller
+    """
+    return Area(gpd.read_file(filename)['geometry'].iloc[0])
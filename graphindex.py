@@ -0,0 +1,260 @@
+import heapq
+import numpy as np
+
+# Folder holding the graphml files and everything derived from them, same as osmnx default data folder
+DATA_FOLDER = "data"
+
+# Search strategies accepted by CSRGraph.shortest_path, alt needs a landmark table (see landmarks.py)
+METHODS = ("dijkstra", "astar", "bidirectional", "alt")
+
+# Radius of earth in metres, used by the A* heuristic
+EARTH_RADIUS = 6371000
+
+
+class CSRGraph:
+    """
+    Compressed sparse row adjacency index of an osmnx graph
+    offsets[i]:offsets[i + 1] are the slots of the out edges of dense node i,
+    targets / lengths / edge_rows hold the dense target node, the length and the row of the edge in the edges GeoDataFrame
+    Build it once per process and share it with every query
+    """
+
+    # Arrays that fully describe the index, stored as is in a graph snapshot (see snapshot.py)
+    ARRAYS = ("ids", "x", "y", "offsets", "targets", "lengths", "edge_rows",
+              "rev_offsets", "rev_sources", "rev_lengths")
+
+    def __init__(self, nodes, edges=None):
+        # osmid <-> dense id
+        self.ids = np.asarray(nodes.index.values, dtype=np.int64)
+        id_of = {osmid: i for i, osmid in enumerate(self.ids.tolist())}
+        self.x = np.asarray(nodes['x'].values, dtype=np.float64)
+        self.y = np.asarray(nodes['y'].values, dtype=np.float64)
+
+        # Graphs with nodes only (bus stops, mrt stations) have no edges
+        count = 0 if edges is None else len(edges)
+        u = np.fromiter((id_of[osmid] for osmid in edges['u'].values),
+                        dtype=np.int64, count=count) if count else np.zeros(0, dtype=np.int64)
+        v = np.fromiter((id_of[osmid] for osmid in edges['v'].values),
+                        dtype=np.int64, count=count) if count else np.zeros(0, dtype=np.int64)
+        length = np.asarray(edges['length'].values, dtype=np.float64) if count else np.zeros(0)
+
+        # Sort the edges by source node so that every node's neighbours are contiguous
+        order = np.argsort(u, kind='stable')
+        self.offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(u, minlength=len(self.ids)), out=self.offsets[1:])
+        self.targets = v[order]
+        self.lengths = length[order]
+        self.edge_rows = order
+
+        # Reverse index (in edges of every node) for the backward half of bidirectional search
+        rev_order = np.argsort(v, kind='stable')
+        self.rev_offsets = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(v, minlength=len(self.ids)), out=self.rev_offsets[1:])
+        self.rev_sources = u[rev_order]
+        self.rev_lengths = length[rev_order]
+
+        self._prepare()
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild the index from a dict of CSRGraph.ARRAYS, e.g. memory mapped arrays of a graph snapshot
+        """
+        index = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        index._prepare()
+        return index
+
+    def _prepare(self):
+        # Per process lookups that are cheap to derive from the arrays
+        self.id_of = {osmid: i for i, osmid in enumerate(self.ids.tolist())}
+
+        # Radians and cos(lat) of every node for the haversine heuristic
+        self.lat_rad = np.radians(self.y)
+        self.lon_rad = np.radians(self.x)
+        self.cos_lat = np.cos(self.lat_rad)
+
+        # Optional landmarks.LandmarkIndex, set by the owner of the index
+        self.landmarks = None
+
+        # (sorted (u, v) keys of the edges, their rows), built on first use by edge_rows_between
+        # and published in one assignment, so threads sharing the index never see half of it
+        self.pairs = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def node_id(self, osmid):
+        """
+        Return the dense id of an osmid
+        """
+        return self.id_of[osmid]
+
+    def edge_rows_between(self, route):
+        """
+        Row in the edges GeoDataFrame of the edge of every hop of a route of dense ids, looked up in one searchsorted
+        The shortest edge is used between nodes with parallel edges, -1 for a hop without an edge
+        """
+        pairs = self.pairs
+        if pairs is None:
+            sources = np.repeat(np.arange(len(self.ids), dtype=np.int64), np.diff(self.offsets))
+            keys = sources * len(self.ids) + self.targets
+            # shortest edge first for every (u, v), then keep the first of every key
+            order = np.lexsort((self.lengths, keys))
+            pair_keys, first = np.unique(keys[order], return_index=True)
+            # a concurrent first call builds the same arrays, whichever is published last is kept
+            pairs = self.pairs = (pair_keys, np.asarray(self.edge_rows)[order[first]])
+        pair_keys, pair_rows = pairs
+        route = np.asarray(route, dtype=np.int64)
+        keys = route[:-1] * len(self.ids) + route[1:]
+        if len(pair_keys) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(pair_keys, keys), len(pair_keys) - 1)
+        return np.where(pair_keys[positions] == keys, pair_rows[positions], -1)
+
+    def shortest_path(self, source, target, method="dijkstra"):
+        """
+        Shortest path between two dense ids with the selected search strategy
+        All strategies return the same shortest distance
+        Return (list of dense ids from source to target, distance, number of settled nodes),
+        route is None and distance is inf if target cannot be reached
+        """
+        if method == "dijkstra":
+            return self.dijkstra(source, target)
+        if method == "astar":
+            return self.astar(source, target)
+        if method == "bidirectional":
+            return self.bidirectional(source, target)
+        if method == "alt":
+            return self.alt(source, target)
+        raise ValueError("Unknown search method " + str(method))
+
+    def heuristic(self, target):
+        """
+        Return the haversine distance in metres from every node to the target, as an array
+        Edge lengths are rounded to the millimetre, scale down slightly so the estimate never overshoots
+        """
+        dlat = self.lat_rad - self.lat_rad[target]
+        dlon = self.lon_rad - self.lon_rad[target]
+        a = np.sin(dlat / 2) ** 2 + self.cos_lat * \
+            self.cos_lat[target] * np.sin(dlon / 2) ** 2
+        return 0.999 * 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+    def dijkstra(self, source, target):
+        """
+        Plain Dijkstra using min-heap
+        """
+        return self._search(source, target, None)
+
+    def astar(self, source, target):
+        """
+        A* using the haversine distance to the target as heuristic
+        """
+        return self._search(source, target, self.heuristic(target))
+
+    def alt(self, source, target):
+        """
+        A* using the precomputed landmark lower bounds as heuristic
+        """
+        if self.landmarks is None:
+            raise ValueError("No landmark table loaded for this graph")
+        return self._search(source, target, self.landmarks.estimate(target))
+
+    def distances_from(self, source, reverse=False):
+        """
+        One-to-all Dijkstra, return the distance from source to every node as an array (inf if unreachable)
+        With reverse=True the in edges are followed, giving the distance from every node to source
+        """
+        if reverse:
+            offsets, others, lengths = self.rev_offsets, self.rev_sources, self.rev_lengths
+        else:
+            offsets, others, lengths = self.offsets, self.targets, self.lengths
+        dist = np.full(len(self.ids), np.inf)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            distance, curr = heapq.heappop(heap)
+            if distance > dist[curr]:
+                continue
+            for slot in range(offsets[curr], offsets[curr + 1]):
+                nxt = others[slot]
+                nxt_distance = distance + lengths[slot]
+                if nxt_distance < dist[nxt]:
+                    dist[nxt] = nxt_distance
+                    heapq.heappush(heap, (nxt_distance, nxt))
+        return dist
+
+    def _search(self, source, target, estimate):
+        offsets, targets, lengths = self.offsets, self.targets, self.lengths
+        # min-heap element's structure = [distance + estimate, distance, previous node, current node]
+        heap = [(0.0, 0.0, -1, source)]
+        path = {}
+        while heap:
+            _, distance, prev, curr = heapq.heappop(heap)
+            if curr in path:
+                continue
+            path[curr] = prev
+            if curr == target:
+                return self._unwind(path, curr)[::-1], distance, len(path)
+            # Only the neighbours of the current node are touched
+            for slot in range(offsets[curr], offsets[curr + 1]):
+                nxt = int(targets[slot])
+                if nxt not in path:
+                    nxt_distance = distance + lengths[slot]
+                    priority = nxt_distance if estimate is None else nxt_distance + estimate[nxt]
+                    heapq.heappush(heap, (priority, nxt_distance, curr, nxt))
+        return None, float('inf'), len(path)
+
+    def bidirectional(self, source, target, blocked=None):
+        """
+        Bidirectional Dijkstra, one search forward from the source and one backward from the target
+        Stops once the two heap tops together can no longer beat the best meeting point
+        blocked = optional boolean array of the dense ids the route may not go through
+        """
+        if source == target:
+            return [source], 0.0, 1
+        # index 0 = forward search on out edges, index 1 = backward search on in edges
+        adjacency = ((self.offsets, self.targets, self.lengths),
+                     (self.rev_offsets, self.rev_sources, self.rev_lengths))
+        heaps = ([(0.0, source)], [(0.0, target)])
+        settled = (set(), set())
+        dists = ({source: 0.0}, {target: 0.0})
+        parents = ({source: -1}, {target: -1})
+        best, meet = float('inf'), None
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            # Expand the side with the smaller frontier
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            distance, curr = heapq.heappop(heaps[side])
+            if curr in settled[side]:
+                continue
+            settled[side].add(curr)
+            offsets, others, lengths = adjacency[side]
+            for slot in range(offsets[curr], offsets[curr + 1]):
+                nxt = int(others[slot])
+                if blocked is not None and blocked[nxt]:
+                    continue
+                nxt_distance = distance + lengths[slot]
+                if nxt_distance < dists[side].get(nxt, float('inf')):
+                    dists[side][nxt] = nxt_distance
+                    parents[side][nxt] = curr
+                    heapq.heappush(heaps[side], (nxt_distance, nxt))
+                    # Check if the two searches meet with a shorter total
+                    if nxt in dists[1 - side] and nxt_distance + dists[1 - side][nxt] < best:
+                        best = nxt_distance + dists[1 - side][nxt]
+                        meet = nxt
+        count = len(settled[0]) + len(settled[1])
+        if meet is None:
+            return None, float('inf'), count
+        # Join the forward tree (source -> meet) and the backward tree (meet -> target)
+        route = self._unwind(parents[0], meet)[::-1] + \
+            self._unwind(parents[1], meet)[1:]
+        return route, best, count
+
+    def _unwind(self, path, node):
+        route = [node]
+        while path[route[-1]] != -1:
+            route.append(path[route[-1]])
+        return route
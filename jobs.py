@@ -0,0 +1,91 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads computing routes, the searches hold the GIL most of the time so a few are enough
+WORKERS = 2
+# Jobs waiting or running at most, new jobs are refused past this
+MAX_PENDING = 16
+# Finished jobs kept for polling, oldest dropped first
+MAX_FINISHED = 256
+
+
+class QueueFull(Exception):
+    """
+    Raised by JobQueue.submit when MAX_PENDING jobs are already waiting or running
+    """
+    pass
+
+
+class JobQueue:
+    """
+    Bounded queue of route computations run on a thread pool
+    submit returns a job id at once, the caller polls status / result with it
+    """
+
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING, max_finished=MAX_FINISHED):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        # job id -> {"status", "result", "error", "submitted", "finished"}, in submission order
+        self.jobs = OrderedDict()
+        self.pending = 0
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on the pool, return the job id
+        Raises QueueFull instead of queueing behind max_pending jobs
+        """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise QueueFull("Too many routes being computed, try again later")
+            self.pending += 1
+            job_id = str(next(self.ids))
+            self.jobs[job_id] = {"status": "pending", "result": None, "error": None,
+                                 "submitted": time.time(), "finished": None}
+        self.executor.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        with self.lock:
+            self.jobs[job_id]["status"] = "running"
+        try:
+            result, error, status = fn(*args), None, "done"
+        except Exception as e:
+            result, error, status = None, str(e), "failed"
+        with self.lock:
+            self.jobs[job_id].update(status=status, result=result, error=error, finished=time.time())
+            self.pending -= 1
+            # forget the oldest finished jobs
+            finished = [key for key, job in self.jobs.items() if job["finished"] is not None]
+            for key in finished[:max(0, len(finished) - self.max_finished)]:
+                del self.jobs[key]
+
+    def status(self, job_id):
+        """
+        Status of a job ("pending", "running", "done" or "failed") and its error, None for an unknown job
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            return {"status": job["status"], "error": job["error"]}
+
+    def result(self, job_id):
+        """
+        Result of a finished job, None if it is unknown, not finished or failed
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return job["result"] if job is not None else None
+
+    def stats(self):
+        """
+        Number of jobs waiting or running and of finished jobs kept
+        """
+        with self.lock:
+            return {"pending": self.pending, "kept": len(self.jobs), "max_pending": self.max_pending}
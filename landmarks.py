@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from graphindex import DATA_FOLDER
+
+# Number of landmarks per graph
+LANDMARK_COUNT = 8
+
+
+class LandmarkIndex:
+    """
+    ALT (A*, Landmarks, Triangle inequality) table of a CSRGraph
+    forward[k][v] = distance from landmark k to node v, backward[k][v] = distance from node v to landmark k
+    Any node's distance to the target is at least max(forward[k][t] - forward[k][v], backward[k][v] - backward[k][t])
+    """
+
+    def __init__(self, ids, landmarks, forward, backward):
+        self.ids = ids
+        self.landmarks = landmarks
+        self.forward = forward
+        self.backward = backward
+
+    @classmethod
+    def build(cls, index, count=LANDMARK_COUNT):
+        """
+        Pick landmarks with farthest point selection and run one forward and one backward search from each
+        """
+        landmarks = []
+        forward = []
+        backward = []
+        # Distance from the chosen landmarks to every node, start from node 0
+        spread = index.distances_from(0)
+        for i in range(min(count, len(index))):
+            # Next landmark is the reachable node farthest from every landmark chosen so far
+            reachable = np.where(np.isfinite(spread), spread, -1)
+            landmark = int(np.argmax(reachable))
+            landmarks.append(landmark)
+            forward.append(index.distances_from(landmark))
+            backward.append(index.distances_from(landmark, reverse=True))
+            spread = forward[-1] if i == 0 else np.minimum(spread, forward[-1])
+        return cls(index.ids, np.array(landmarks, dtype=np.int64),
+                   np.array(forward), np.array(backward))
+
+    def save(self, path):
+        np.savez(path, ids=self.ids, landmarks=self.landmarks,
+                 forward=self.forward, backward=self.backward)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['ids'], data['landmarks'], data['forward'], data['backward'])
+
+    def estimate(self, target):
+        """
+        Return the landmark lower bound of the distance from every node to the target, as an array
+        """
+        with np.errstate(invalid='ignore'):
+            bounds = np.concatenate((self.forward[:, target][:, None] - self.forward,
+                                     self.backward - self.backward[:, target][:, None]))
+        # Both distances unknown (inf - inf) gives no information
+        bounds[np.isnan(bounds)] = 0
+        return np.maximum(bounds.max(axis=0), 0)
+
+
+def landmark_path(filename, folder=DATA_FOLDER):
+    """
+    Landmark table is saved next to the graphml, walk.graphml -> walk.alt.npz
+    """
+    return os.path.join(folder, os.path.splitext(filename)[0] + ".alt.npz")
+
+
+def load_landmarks(index, filename, folder=DATA_FOLDER):
+    """
+    Load the landmark table of a graphml file, build and save it first if it is missing or older than the graphml
+    """
+    path = landmark_path(filename, folder)
+    graphml = os.path.join(folder, filename)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(graphml):
+        table = LandmarkIndex.load(path)
+        if np.array_equal(table.ids, index.ids):
+            return table
+    table = LandmarkIndex.build(index)
+    table.save(path)
+    return table
+
+
+if __name__ == "__main__":
+    # Offline preprocessing: python landmarks.py [graphml ...]
+    import sys
+    from snapshot import load_snapshot
+
+    for filename in sys.argv[1:] or ["walk.graphml", "drive.graphml"]:
+        table = LandmarkIndex.build(load_snapshot(filename).index())
+        table.save(landmark_path(filename))
+        print("Saved " + str(len(table.landmarks)) + " landmarks to " + landmark_path(filename))
@@ -0,0 +1,93 @@
+import sys
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from snapshot import load_snapshot
+from spatial import SpatialIndex
+from multimodal import WALK_SPEED
+
+# Named point sets of the command line
+HDB_FILE = 'geojson/hdb.geojson'
+
+
+def distance_matrix(index, spatial, origins, destinations):
+    """
+    N x M walking distance in metres from every origin to every destination, both given as (lat, lon) pairs
+    Every point is snapped to its nearest node, one one-to-all search is run per distinct node on the smaller side
+    and every point of the other side reads its distance from the same search tree
+    The distance from a point to its node is added on both ends, unreachable pairs are inf
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+    origin_nodes, origin_distances = spatial.nearest_nodes(origins[:, 0], origins[:, 1])
+    destination_nodes, destination_distances = spatial.nearest_nodes(destinations[:, 0], destinations[:, 1])
+
+    # search forward from the origins, or backward from the destinations if there are fewer of them
+    reverse = len(np.unique(destination_nodes)) < len(np.unique(origin_nodes))
+    sources, others = (destination_nodes, origin_nodes) if reverse else (origin_nodes, destination_nodes)
+    unique, inverse = np.unique(sources, return_inverse=True)
+    matrix = np.empty((len(sources), len(others)))
+    for i, node in enumerate(unique):
+        matrix[inverse == i] = index.distances_from(node, reverse=reverse)[others]
+    if reverse:
+        matrix = matrix.T
+    return matrix + origin_distances[:, None] + destination_distances[None, :]
+
+
+def time_matrix(index, spatial, origins, destinations):
+    """
+    N x M walking time in seconds, see distance_matrix
+    """
+    return distance_matrix(index, spatial, origins, destinations) / WALK_SPEED
+
+
+def load_points(name):
+    """
+    Labels and (lat, lon) array of a named point set (hdb, lrt, busstops),
+    a geojson file of points or a csv file with lat and lon columns
+    """
+    if name == "hdb":
+        name = HDB_FILE
+    if name in ("lrt", "busstops"):
+        nodes = load_snapshot("mrt.graphml" if name == "lrt" else "busstop.graphml").nodes_frame()
+        label = "ref" if name == "lrt" else "asset_ref"
+        labels = [str(ref) if ref is not None else str(osmid) for ref, osmid in zip(nodes[label], nodes['osmid'])]
+        return labels, np.column_stack((nodes['y'].values, nodes['x'].values))
+    if name.endswith(".csv"):
+        df = pd.read_csv(name)
+        labels = df['id'] if 'id' in df.columns else df.index
+        return [str(label) for label in labels], df[['lat', 'lon']].values
+    df = gpd.read_file(name)
+    # polygons (buildings) are reduced to their centre
+    points = df['geometry'].representative_point()
+    labels = df['id'] if 'id' in df.columns else df.index
+    return [str(label) for label in labels], np.column_stack((points.y.values, points.x.values))
+
+
+if __name__ == "__main__":
+    # python matrix.py ORIGINS DESTINATIONS OUTPUT [time]
+    # ORIGINS / DESTINATIONS = hdb, lrt, busstops, a geojson file or a csv file with lat and lon columns
+    # OUTPUT = .npy (matrix only) or .parquet (one row per origin, destination pair with their labels, needs pyarrow)
+    # distances in metres by default, walking time in seconds with "time"
+    if len(sys.argv) < 4:
+        raise SystemExit("Usage: python matrix.py ORIGINS DESTINATIONS OUTPUT [time]")
+    origin_labels, origins = load_points(sys.argv[1])
+    destination_labels, destinations = load_points(sys.argv[2])
+
+    snapshot = load_snapshot("walk.graphml")
+    index = snapshot.index()
+    spatial = SpatialIndex(snapshot)
+
+    column = "time" if len(sys.argv) > 4 and sys.argv[4] == "time" else "distance"
+    if column == "time":
+        matrix = time_matrix(index, spatial, origins, destinations)
+    else:
+        matrix = distance_matrix(index, spatial, origins, destinations)
+
+    if sys.argv[3].endswith(".parquet"):
+        pd.DataFrame({"origin": np.repeat(origin_labels, len(destination_labels)),
+                      "destination": np.tile(destination_labels, len(origin_labels)),
+                      column: matrix.ravel()}).to_parquet(sys.argv[3])
+    else:
+        np.save(sys.argv[3], matrix)
+    print("Saved " + str(matrix.shape[0]) + " x " + str(matrix.shape[1]) + " matrix to " + sys.argv[3])
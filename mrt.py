@@ -1,37 +1,148 @@
-import osmnx as ox
 import folium as fo
-import geopandas as gpd
 import heapq as hq
-import pandas as pd
-import json as js
-import networkx as nx
 import numpy as np
-import geopandas as gpd
-from pandas import json_normalize
-import json
 import os
-import shapely
-
-# read the csv the csv file to get all the station name and coordinates in the east loop
-df_east = pd.read_csv('MRT/MRT-EAST.csv')
-df_east['geometry'] = df_east['geometry'].apply(shapely.wkt.loads)
-geo_df_east = gpd.GeoDataFrame(df_east, crs="EPSG:4326", geometry='geometry')
-# read the csv the csv file to get all the station name and coordinates in the west loop
-df_west = pd.read_csv('MRT/MRT-WEST.csv')
-df_west['geometry'] = df_west['geometry'].apply(shapely.wkt.loads)
-geo_df_west = gpd.GeoDataFrame(df_west, crs="EPSG:4326", geometry='geometry')
+import hashlib
+import pickle
+from graphindex import DATA_FOLDER
+from routefeatures import line_geojson
+from snapshot import load_snapshot
+from spatial import SpatialIndex
+from stations import StationRegistry, line_files
+
+# LRT average speed in m/s, seconds stopped at every station and seconds between trains
+LRT_SPEED = 30 / 3.6
+LRT_DWELL = 30
+LRT_HEADWAY = 300
+
+# Station registry and all pairs LRT table: path, hops, track length, ride time and merged line of every ordered station pair
+LRT_TABLE_FILE = os.path.join(DATA_FOLDER, "lrttable.pkl")
+# Bump when the layout of the artifact changes, older ones are rebuilt
+LRT_TABLE_VERSION = 2
+
+
+def lrt_table_fingerprint():
+    """
+    Content hash of the LRT line files and of mrt.graphml the registry and the table are built from
+    """
+    digest = hashlib.sha1()
+    for filename in sorted(line_files().values()) + [os.path.join(DATA_FOLDER, "mrt.graphml")]:
+        digest.update(filename.encode())
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_lrt_table(stations):
+    """
+    Fastest track path between every ordered pair of stations of a StationRegistry
+    Trains run both ways round every loop, so a pair takes whichever direction is faster,
+    changing between the loops (at Punggol) waits half the headway
+    Returns {(from osmid, to osmid): {"path", "hops", "length", "time", "lines", "line"}}
+    with the station osmids, track metres, ride seconds, loops taken in order and the (lon, lat) of the track
+    """
+    # track between adjacent stations, both ways
+    adjacency = {}
+    for segment, (u, v) in enumerate(zip(stations.segment_u.tolist(), stations.segment_v.tolist())):
+        length, name = float(stations.segment_length[segment]), stations.segment_line[segment]
+        coordinates = stations.segment_points(segment)
+        adjacency.setdefault(u, []).append((v, length, name, coordinates))
+        adjacency.setdefault(v, []).append((u, length, name, coordinates[::-1]))
+
+    table = {}
+    for source in adjacency:
+        # dijkstra over (station, loop of the last hop) states, the loop is needed to charge the change of train
+        heap = [(0.0, source, None)]
+        best = {(source, None): 0.0}
+        parent = {}
+        arrival = {}
+        while heap:
+            time, station, line = hq.heappop(heap)
+            if best[(station, line)] < time:
+                continue
+            # first time a station is popped is its fastest arrival
+            arrival.setdefault(station, (station, line))
+            for neighbour, length, name, coordinates in adjacency[station]:
+                ride = time + length / LRT_SPEED + LRT_DWELL
+                if line is not None and name != line:
+                    ride += LRT_HEADWAY / 2
+                if ride < best.get((neighbour, name), float('inf')):
+                    best[(neighbour, name)] = ride
+                    parent[(neighbour, name)] = ((station, line), length, coordinates)
+                    hq.heappush(heap, (ride, neighbour, name))
+
+        for target, state in arrival.items():
+            if target == source:
+                continue
+            entry = {"path": [target], "hops": 0, "length": 0.0, "time": best[state], "lines": []}
+            parts = []
+            while state in parent:
+                if not entry["lines"] or entry["lines"][-1] != state[1]:
+                    entry["lines"].append(state[1])
+                state, length, coordinates = parent[state]
+                entry["path"].append(state[0])
+                entry["length"] += length
+                parts.append(coordinates)
+            entry["path"].reverse()
+            entry["lines"].reverse()
+            entry["hops"] = len(entry["path"]) - 1
+            entry["line"] = np.concatenate(parts[::-1])
+            table[(source, target)] = entry
+    return table
+
+
+def load_lrt_network(nodes_df, rebuild=False):
+    """
+    Load the station registry and the all pairs LRT table from data/lrttable.pkl, rebuilt from the line files and
+    the station nodes of mrt.graphml when missing, of an older version or when a source file changed
+    """
+    fingerprint = lrt_table_fingerprint()
+    stored = None
+    if not rebuild and os.path.exists(LRT_TABLE_FILE):
+        with open(LRT_TABLE_FILE, 'rb') as f:
+            stored = pickle.load(f)
+        if stored.get('version') != LRT_TABLE_VERSION or stored.get('fingerprint') != fingerprint:
+            stored = None
+    if stored is None:
+        stations = StationRegistry.build(nodes_df)
+        stored = {'version': LRT_TABLE_VERSION, 'fingerprint': fingerprint, 'stations': stations,
+                  'table': build_lrt_table(stations)}
+        with open(LRT_TABLE_FILE, 'wb') as f:
+            pickle.dump(stored, f)
+        print("LRT table saved to " + LRT_TABLE_FILE)
+    return stored['stations'], stored['table']
 
 
 class Mrt:
     def __init__(self):
-        start_x = None
-        start_y = None
-        end_x = None
-        end_y = None
-        lastx = None
-        lasty = None
+        # Start, end and last station of the latest MrtAlgo call
+        self.start_x = None
+        self.start_y = None
+        self.end_x = None
+        self.end_y = None
+        self.lastx = None
+        self.lasty = None
+
+        # The station graph and tables are static, load them once for every MrtAlgo call
+        # using Osmnx ro create a graph with nodes.
+        # mrt_station_response = ox.core.osm_net_download(
+        #     polygon, infrastructure='node["railway"="station"]')
+        # mrt_station_Graph = ox.core.create_graph(
+        #     mrt_station_response, retain_all=True)
+        self.mrt_station_snapshot = load_snapshot("mrt.graphml")
+        self.mrt_station_Node = self.mrt_station_snapshot.nodes_frame()
+        # Nearest station index
+        self.mrt_station_spatial = SpatialIndex(self.mrt_station_snapshot)
+
+        # Stations (name, lines, coordinates), track between adjacent stations and the path, hops, track length,
+        # ride time and line of every ordered station pair, built from MRT/MRT-*.csv and mrt.graphml (data/lrttable.pkl)
+        self.stations, self.table = load_lrt_network(self.mrt_station_Node)
 
     def MrtAlgo(self, x1, y1, x2, y2):
+        """
+        LRT route between the stations nearest to (x1, y1) and (x2, y2), return it as a folium FeatureGroup
+        Standalone LRT only route for scripts and notebooks, the web app and main.py plan with multimodal.MultimodalGraph
+        """
         self.start_x = x1
         self.start_y = y1
         self.end_x = x2
@@ -39,167 +150,79 @@ class Mrt:
 
         start_coordinate = (self.start_x, self.start_y)
         end_coordinate = (self.end_x, self.end_y)
-        # Define the cordinates where the map will point to in folium.
-        centreCoordinate = (1.407937, 103.901702)
-        pm = fo.Map(location=centreCoordinate,
-                    zoom_start=15, control_scale=True)
+        # Layer of the stations and LRT line of the route, the caller adds it to its own map
+        pm = fo.FeatureGroup(name="MRT")
         # plot the Start point and end point on the map with folium icon
         fo.Marker(start_coordinate, popup="start", icon=fo.Icon(
             color='red', icon='info-sign')).add_to(pm)
         fo.Marker(end_coordinate, popup="end", icon=fo.Icon(
             color='red', icon='info-sign')).add_to(pm)
 
-        # Read the punggol map
-        punggol = gpd.read_file('geojson/polygon-punggol.geojson')
-        polygon = punggol['geometry'].iloc[0]
-
-        # using Osmnx ro create a graph with nodes.
-        # mrt_station_response = ox.core.osm_net_download(
-        #     polygon, infrastructure='node["railway"="station"]')
-        # mrt_station_Graph = ox.core.create_graph(
-        #     mrt_station_response, retain_all=True)
-        mrt_station_Graph = ox.save_load.load_graphml("mrt.graphml")
-        mrt_station_Node, mrt_station_Edge = ox.graph_to_gdfs(
-            mrt_station_Graph)
-
-        # Define the name and osm id of the mrt station west and East Loop
-        mrt_west_stations = {1840734606: 'Sam Kee', 1840734600: 'Punggol Point', 1840734607: 'Samudera',
-                             1840734598: 'Nibong', 1840734610: 'Sumang', 1840734608: 'Soo Teck', 213085056: 'Punggol'}
-        mrt_east_stations = {1840734592: 'Cove', 1840734597: 'Meridian', 1840734578: 'Coral Edge',
-                             1840734604: 'Riviera', 1840734594: 'Kadaloor', 1840734599: 'Oasis', 1840734593: 'Damai', 213085056: 'Punggol'}
-
-        # Define Graph of the station with its osm id
-        graph = {213085056: [1840734593, 1840734592, 1840734608, 1840734606],
-                 1840734593: [213085056, 1840734599],
-                 1840734599: [1840734593, 1840734594],
-                 1840734594: [1840734599, 1840734604],
-                 1840734604: [1840734594, 1840734578],
-                 1840734578: [1840734604, 1840734597],
-                 1840734597: [1840734578, 1840734592],
-                 1840734592: [1840734597, 213085056],
-                 1840734608: [213085056, 1840734610],
-                 1840734610: [1840734608, 1840734598],
-                 1840734598: [1840734610, 1840734607],
-                 1840734607: [1840734598, 1840734600],
-                 1840734600: [1840734607, 1840734606],
-                 1840734606: [1840734600, 213085056]
-                 }
         # using Osmnx to get the nearest nodes from the start and end cordinates
-        mrt_start_osmid = ox.geo_utils.get_nearest_node(
-            mrt_station_Graph, start_coordinate)
-        mrt_end_osmid = ox.geo_utils.get_nearest_node(
-            mrt_station_Graph, end_coordinate)
-
-        # using BFD algorithm to find the shortest MRT path that the user can take
-        def bfs_shortest_path(graph, start, end):
-
-            visited = []
-            queue = [[start]]
-
-            if start == end:
-                return 0
-            # traverse throug the graph and find its neighbour
-            while queue:
-                path = queue.pop(0)
-                node = path[-1]
-                if node not in visited:
-                    neighbours = graph[node]
-                    # if node neighbour is visited it will be marked as visited and it will be appended to the queue
-                    for neighbour in neighbours:
-                        short_route = list(path)
-                        short_route.append(neighbour)
-                        queue.append(short_route)
-                        # stop when end of graph
-                        if neighbour == end:
-                            return short_route
-
-                    visited.append(node)
-
-            return 0
-
-        # Displaying the station information and mark all the station in the route
-        def mrt_station_display(osm_df, east, west, route):
-            for station in route:
-                # with the use of OSMID to get the latitude and longtitude of the west LTR line
-                if station in west:
-                    current_coord_lat = float(
-                        osm_df[osm_df['osmid'] == station]['y'].values[0])
-                    current_coord_long = float(
-                        osm_df[osm_df['osmid'] == station]['x'].values[0])
-                    print(west[station])
-                    # plot the path of the MRt on the map with blue lines
-                    fo.Marker([current_coord_lat, current_coord_long], popup=west[station], icon=fo.Icon(
-                        color='blue', icon='info-sign')).add_to(pm)
-                else:
-                    # if staion not in the west loop it will search the value from the east loop
-                    # with the use of OSMID to get the latitude and longtitude of the west LTR line
-                    current_coord_lat = float(
-                        osm_df[osm_df['osmid'] == station]['y'].values[0])
-                    current_coord_long = float(
-                        osm_df[osm_df['osmid'] == station]['x'].values[0])
-                    # plot the path of the MRt on the map with blue lines
-                    fo.Marker([current_coord_lat, current_coord_long], popup=east[station], icon=fo.Icon(
-                        color='blue', icon='info-sign')).add_to(pm)
-                    print(east[station])
-
-        # loop throught the csv file and get allt he cordinatates that is needed to plot the graph from station to station
-        def mrt_route_display(east, east_geo, west, west_geo, route, fo_map):
-            result_df = pd.DataFrame(columns=west_geo.columns)
-            for i in range(len(route) - 1):
-                current_station, next_station = route[i], route[i + 1]
-                if current_station in west and next_station in west:
-                    if ((west_geo['u'] == current_station) & (west_geo['v'] == next_station)).any():
-                        row = west_geo[(west_geo['u'] == current_station)
-                                       & (west_geo['v'] == next_station)]
-                    else:
-                        row = west_geo[(west_geo['v'] == current_station)
-                                       & (west_geo['u'] == next_station)]
-                else:
-                    if ((east_geo['u'] == current_station) & (east_geo['v'] == next_station)).any():
-                        row = east_geo[(east_geo['u'] == current_station)
-                                       & (east_geo['v'] == next_station)]
-                    else:
-                        row = east_geo[(east_geo['v'] == current_station)
-                                       & (east_geo['u'] == next_station)]
-                result_df = result_df.append(row)
-            result_geo_df = gpd.GeoDataFrame(
-                result_df, crs="EPSG:4326", geometry='geometry')
-            # print the route connectiong the star node and the end nodes
-            fo.GeoJson(result_geo_df, style_function=lambda x: {
-                       "color": "blue", "weight": "3"}, name="MRT").add_to(fo_map)
-
-        route = bfs_shortest_path(graph, mrt_start_osmid, mrt_end_osmid)
-
-        # if the mrt station start and end at the same staion show user that MRT is not needed
-        print("\n MRT Taken:")
+        snapped = self.mrt_station_spatial.snap([start_coordinate, end_coordinate])
+        mrt_start_osmid = int(snapped.nodes[0])
+        mrt_end_osmid = int(snapped.nodes[1])
+
+        # fastest LRT path from the precomputed table, 0 if both ends are at the same station
+        ride = self.ride(mrt_start_osmid, mrt_end_osmid)
+        route = ride["path"] if ride is not None else 0
+
+        # if the mrt station start and end at the same staion MRT is not needed
         if route != 0:
-            print(route)
-            mrt_station_display(mrt_station_Node, mrt_east_stations,
-                                mrt_west_stations, route)
-            mrt_route_display(mrt_east_stations, geo_df_east,
-                              mrt_west_stations, geo_df_west, route, pm)
+            self.mrt_station_display(route, pm)
+            self.mrt_route_display(route, pm)
             # if start station is the same as the end station, print MRT not needed
             # OSMID of Station
-            osmid_st = int(route[0])
-            osmid = int(route[-1])
-            self.firstx = mrt_station_Node[mrt_station_Node["osmid"]
-                                           == osmid_st]['y'].values[0]
-            self.firsty = mrt_station_Node[mrt_station_Node["osmid"]
-                                           == osmid_st]['x'].values[0]
-            self.lasty = mrt_station_Node[mrt_station_Node["osmid"]
-                                          == osmid]['x'].values[0]
-            self.lastx = mrt_station_Node[mrt_station_Node["osmid"]
-                                          == osmid]['y'].values[0]
+            self.firstx, self.firsty = self.stations.coords(route[0])
+            self.lastx, self.lasty = self.stations.coords(route[-1])
         else:
-            print("MRT is not needed!")
             self.lasty = self.start_y
             self.lastx = self.start_x
-        print("\n")
 
         return pm
         # self.last = (lastlong, lastlat)
         # self.last = int(route[-1])
 
+    def ride(self, start, end):
+        """
+        Table entry of the LRT ride from station osmid start to station osmid end, None if they are the same station
+        """
+        return self.table.get((start, end))
+
+    def mrt_station_display(self, route, fo_map):
+        """
+        Displaying the station information and mark all the station in the route
+        """
+        for station in route:
+            # name, latitude and longtitude of the station from the station registry
+            name = self.stations.get_name(station)
+            fo.Marker(list(self.stations.coords(station)), popup=name, icon=fo.Icon(
+                color='blue', icon='info-sign')).add_to(fo_map)
+
+    def mrt_route_display(self, route, fo_map):
+        """
+        Plot the LRT line of a route of station osmids
+        """
+        self.style_layer(self.route_geojson(route)).add_to(fo_map)
+
+    def style_layer(self, geojson):
+        """
+        MRT layer of a LRT route GeoJSON
+        """
+        return fo.GeoJson(geojson, style_function=lambda x: {
+                          "color": "blue", "weight": "3"}, name="MRT")
+
+    def route_geojson(self, route):
+        """
+        Return the GeoJSON of the LRT line of a route of station osmids, merged into one LineString
+        """
+        # the whole line of the fastest ride is in the table, other paths are joined from the station to station track
+        ride = self.ride(route[0], route[-1]) if len(route) > 1 else None
+        if ride is not None and ride["path"] == list(route):
+            return line_geojson(ride["line"])
+        parts = [self.stations.track(route[i], route[i + 1]) for i in range(len(route) - 1)]
+        return line_geojson(np.concatenate(parts) if parts else [])
+
     def getLastx(self):
         return self.lastx
 
@@ -211,3 +234,8 @@ class Mrt:
 
     def getFirsty(self):
         return self.firsty
+
+
+if __name__ == "__main__":
+    # Build step: python mrt.py rebuilds data/lrttable.pkl
+    load_lrt_network(load_snapshot("mrt.graphml").nodes_frame(), rebuild=True)
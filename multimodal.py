@@ -0,0 +1,200 @@
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from graphindex import CSRGraph
+from mrt import LRT_HEADWAY
+
+# Walking speed in m/s, same as the walking transfers of the bus router
+WALK_SPEED = 1.2
+
+# Node kinds of the multimodal graph
+WALK, STATION, BUS_STOP, BUS_RIDE = range(4)
+
+# One leg of an itinerary, mode = "walk", "lrt" or "bus", service = bus service of a bus leg
+# nodes = walk osmids, station osmids or bus stop codes in travel order, times are seconds from the start
+Leg = namedtuple("Leg", ["mode", "service", "nodes", "depart", "arrive"])
+
+# Fastest itinerary, duration in seconds including the walk from the start / to the end onto the walk graph
+Itinerary = namedtuple("Itinerary", ["duration", "legs", "settled"])
+
+
+class MultimodalGraph:
+    """
+    One graph of the walk network, the LRT lines and the bus services, weighted by travel time in seconds
+    Nodes: walk nodes, LRT stations (boarding and alighting), bus stops and one node per stop of every bus route
+    (riding on that bus)
+    Edges: walking, LRT rides, bus rides, boarding (waits half the headway) and alighting,
+    and walking links between every station / bus stop and its nearest walk node
+    Services with a single departure are never boarded, a search with a depart time skips the services not running then
+    An LRT ride is one edge per station pair from the all pairs LRT table (mrt.Mrt.table), with the same time as the
+    table including the change of loop at Punggol, rides are not chained without walking out and waiting again
+    Headways are fixed, so the expected wait replaces a time expanded graph
+    """
+
+    def __init__(self, walk, mrt, bus):
+        # Snapping of the start and end onto the walk graph
+        self.walk_index = walk.index
+        self.walk_spatial = walk.spatial
+
+        raptor = bus.raptor
+        registry = bus.bus_stops
+        stations = mrt.stations
+        walk_count = len(walk.index)
+        station_count = len(stations)
+        stop_count = len(registry)
+        ride_count = len(raptor.route_stops)
+        # first dense id of every kind of node, every station has a boarding and an alighting node
+        station_base = walk_count
+        exit_base = station_base + station_count
+        stop_base = exit_base + station_count
+        ride_base = stop_base + stop_count
+
+        self.kind = np.concatenate((np.full(walk_count, WALK), np.full(2 * station_count, STATION),
+                                    np.full(stop_count, BUS_STOP), np.full(ride_count, BUS_RIDE)))
+        # walk osmid, station osmid or bus stop code of every node
+        self.ref = np.concatenate((np.asarray(walk.index.ids), stations.osmids, stations.osmids,
+                                   registry.codes, registry.codes[raptor.route_stops]))
+        # station osmids of the LRT path of every station pair, a ride leg is drawn along it
+        self.lrt_table = mrt.table
+        # bus route of every bus ride node, -1 for the other nodes
+        ride_route = np.repeat(np.arange(len(raptor.route_service)), np.diff(raptor.route_offsets))
+        self.ride_route = np.concatenate((np.full(ride_base, -1), ride_route))
+        self.route_service = raptor.route_service
+        x = np.concatenate((walk.index.x, stations.lon, stations.lon, registry.lon, registry.lon[raptor.route_stops]))
+        y = np.concatenate((walk.index.y, stations.lat, stations.lat, registry.lat, registry.lat[raptor.route_stops]))
+
+        u, v, seconds = [], [], []
+
+        def add(sources, targets, times):
+            u.append(np.asarray(sources, dtype=np.int64))
+            v.append(np.asarray(targets, dtype=np.int64))
+            seconds.append(np.broadcast_to(np.asarray(times, dtype=np.float64), len(u[-1])))
+
+        # walking
+        walk_sources = np.repeat(np.arange(walk_count), np.diff(walk.index.offsets))
+        add(walk_sources, walk.index.targets, np.asarray(walk.index.lengths) / WALK_SPEED)
+
+        # LRT rides from the boarding node of a station to the alighting node of another, timed by the LRT table
+        pairs = list(self.lrt_table)
+        add(station_base + np.array([stations.row_of[start] for start, end in pairs], dtype=np.int64),
+            exit_base + np.array([stations.row_of[end] for start, end in pairs], dtype=np.int64),
+            [self.lrt_table[pair]["time"] for pair in pairs])
+
+        # stations and bus stops to their nearest walk node, the wait for the train is paid when entering the station
+        snapped = walk.spatial.nearest_nodes(stations.lat, stations.lon)
+        add(snapped[0], station_base + np.arange(station_count), snapped[1] / WALK_SPEED + LRT_HEADWAY / 2)
+        add(exit_base + np.arange(station_count), snapped[0], snapped[1] / WALK_SPEED)
+        snapped = walk.spatial.nearest_nodes(registry.lat, registry.lon)
+        add(snapped[0], stop_base + np.arange(stop_count), snapped[1] / WALK_SPEED)
+        add(stop_base + np.arange(stop_count), snapped[0], snapped[1] / WALK_SPEED)
+
+        # bus rides to the next stop of the route
+        positions = np.arange(ride_count)
+        last = np.zeros(ride_count, dtype=bool)
+        last[raptor.route_offsets[1:] - 1] = True
+        add(ride_base + positions[~last], ride_base + positions[~last] + 1,
+            np.diff(raptor.route_times)[~last[:-1]] if ride_count else [])
+        # boarding waits half the headway of the route, alighting is free
+        # a route with a single departure has no headway to wait for, it is never boarded
+        headways = np.array([np.mean(np.diff(departures)) if len(departures) > 1 else np.inf
+                             for departures in raptor.route_departures])
+        waits = headways[ride_route] / 2
+        boarding = np.isfinite(waits)
+        add(stop_base + raptor.route_stops[boarding], ride_base + positions[boarding], waits[boarding])
+        add(ride_base + positions, stop_base + raptor.route_stops, 0)
+        # seconds after midnight of the first departure and of the last arrival at the end of every route
+        self.route_open = np.array([departures[0] if len(departures) else np.inf
+                                    for departures in raptor.route_departures])
+        self.route_close = np.array([departures[-1] if len(departures) else -np.inf
+                                     for departures in raptor.route_departures]) + \
+            raptor.route_times[raptor.route_offsets[1:] - 1]
+
+        nodes = pd.DataFrame({'x': x, 'y': y}, index=np.arange(len(x)))
+        edges = pd.DataFrame({'u': np.concatenate(u), 'v': np.concatenate(v), 'length': np.concatenate(seconds)})
+        # lengths of this index are travel times in seconds
+        self.index = CSRGraph(nodes, edges)
+        # Optional routecache.RouteCache shared by every query, set by the owner
+        self.cache = None
+
+    def plan(self, x1, y1, x2, y2, depart=None):
+        """
+        Fastest itinerary from (x1, y1) to (x2, y2) with one search over the whole graph
+        depart = seconds after midnight, only the bus services running then are taken, None for every service
+        Raises ValueError if the end cannot be reached
+        """
+        source, target, access, egress = self.snap(x1, y1, x2, y2)
+        route, duration, settled = self.search(source, target, self.closed_routes(depart))
+        return self.itinerary(route, duration, settled, access, egress)
+
+    def snap(self, x1, y1, x2, y2):
+        """
+        Return the walk nodes (dense ids) nearest to the start and the end and the seconds to walk onto them
+        """
+        snapped = self.walk_spatial.snap([(x1, y1), (x2, y2)])
+        access, egress = snapped.node_distances / WALK_SPEED
+        return self.walk_index.node_id(snapped.nodes[0]), self.walk_index.node_id(snapped.nodes[1]), access, egress
+
+    def closed_routes(self, depart=None):
+        """
+        Bus routes not running at depart (seconds after midnight), as a tuple so that it can be part of a cache key
+        Empty for depart None
+        """
+        if depart is None:
+            return ()
+        return tuple(np.flatnonzero((depart < self.route_open) | (depart > self.route_close)).tolist())
+
+    def search(self, source, target, closed=()):
+        """
+        Fastest route between two walk nodes without riding the bus routes in closed,
+        return (dense ids, seconds, settled nodes)
+        Raises ValueError if the target cannot be reached
+        """
+        blocked = np.isin(self.ride_route, closed) if closed else None
+        # the heuristic of astar / alt is in metres, bidirectional dijkstra only needs the edge weights
+        route, duration, settled = self.index.bidirectional(source, target, blocked)
+        if route is None:
+            raise ValueError("No route found")
+        return route, duration, settled
+
+    def itinerary(self, route, duration, settled, access, egress):
+        """
+        Itinerary of a searched route, adding the walk onto the graph at both ends
+        """
+        return Itinerary(access + duration + egress, self.legs(route, access), settled)
+
+    def legs(self, route, start=0):
+        """
+        Split a route of dense ids into walk / lrt / bus legs, start = seconds already spent before the first node
+        Every leg has at least two nodes
+        """
+        legs = []
+        clock = start
+        split = True
+        for i, node in enumerate(route):
+            if i:
+                clock += self.edge_time(route[i - 1], node)
+            kind = self.kind[node]
+            if kind == BUS_STOP:
+                # getting on or off a bus always ends the leg
+                split = True
+                continue
+            mode = "walk" if kind == WALK else "lrt" if kind == STATION else "bus"
+            service = self.route_service[self.ride_route[node]] if kind == BUS_RIDE else None
+            if split or legs[-1].mode != mode:
+                legs.append(Leg(mode, service, [], clock, clock))
+            legs[-1].nodes.append(int(self.ref[node]))
+            legs[-1] = legs[-1]._replace(arrive=clock)
+            split = False
+        # an LRT leg is a boarding and an alighting station, list every station of the ride
+        legs = [leg._replace(nodes=list(self.lrt_table[(leg.nodes[0], leg.nodes[-1])]["path"]))
+                if leg.mode == "lrt" and len(leg.nodes) == 2 else leg for leg in legs]
+        # a single node (e.g. the walk node next to a station) is no leg to draw, its time is in the next leg
+        return [leg for leg in legs if len(leg.nodes) > 1]
+
+    def edge_time(self, u, v):
+        """
+        Travel time of the fastest edge from dense id u to dense id v, None if there is no edge
+        """
+        offsets, targets, lengths = self.index.offsets, self.index.targets, self.index.lengths
+        times = [lengths[slot] for slot in range(offsets[u], offsets[u + 1]) if targets[slot] == v]
+        return min(times) if times else None
@@ -0,0 +1,282 @@
+import json
+from collections import namedtuple
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+from graphindex import EARTH_RADIUS
+
+# Service headways / timetables, see load_headways for the format
+HEADWAYS_FILE = 'BUS/headways.json'
+
+# Most buses taken in one journey, transfers = buses - 1
+MAX_TRIPS = 4
+
+# One bus ride or walking transfer of a journey, times are in seconds after midnight
+# stops = bus stop codes in travel order, service = None for a walk between two bus stops
+Leg = namedtuple("Leg", ["service", "stops", "depart", "arrive"])
+
+# One Pareto optimal journey, no other journey arrives earlier with as few transfers
+Journey = namedtuple("Journey", ["arrival", "transfers", "legs"])
+
+
+def parse_time(value):
+    """
+    "HH:MM" or "HH:MM:SS" to seconds after midnight
+    """
+    parts = [int(part) for part in str(value).split(":")]
+    return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) > 2 else 0)
+
+
+def format_time(seconds):
+    """
+    Seconds after midnight to "HH:MM"
+    """
+    minutes = int(round(seconds / 60.0))
+    return "%02d:%02d" % (minutes // 60 % 24, minutes % 60)
+
+
+def load_headways(filename=HEADWAYS_FILE):
+    """
+    Read the service headways / timetables
+    {
+        "speed": average bus speed in km/h, "dwell": seconds stopped at every bus stop,
+        "transfer": seconds to change buses, "walk_speed": m/s, "walk_radius": metres of a walking transfer,
+        "default": {"first": "05:30", "last": "23:30", "headway": minutes},
+        "services": {"<service>": {"first", "last", "headway"} or {"departures": ["HH:MM", ...]}}
+    }
+    Services missing in "services" run at the default headway
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """
+    Great circle distance in metres between arrays of points (decimal degrees)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class Raptor:
+    """
+    Round based public transit router (RAPTOR) over the bus stop sequences of every service
+    Every direction of a service is a route, its trips leave the first stop at the service headway or timetable
+    and reach every later stop after the same ride time
+    Round k finds the earliest arrival at every bus stop with k buses by scanning each route once,
+    so the journeys found after each round are Pareto optimal by arrival time and transfers
+    """
+
+    def __init__(self, codes, route_service, route_offsets, route_stops, route_times, route_departures,
+                 stop_route_offsets, stop_routes, stop_positions, foot_offsets, foot_targets, foot_times,
+                 transfer):
+        self.codes = np.asarray(codes)
+        self.row_of = {code: row for row, code in enumerate(self.codes.tolist())}
+        self.route_service = list(route_service)
+        # stops and cumulative ride time from the first stop of route r = route_stops / route_times[route_offsets[r]:route_offsets[r + 1]]
+        self.route_offsets = route_offsets
+        self.route_stops = route_stops
+        self.route_times = route_times
+        # sorted departures of the trips from the first stop of every route
+        self.route_departures = route_departures
+        # routes serving stop s and the position of s in them = stop_routes / stop_positions[stop_route_offsets[s]:stop_route_offsets[s + 1]]
+        self.stop_route_offsets = stop_route_offsets
+        self.stop_routes = stop_routes
+        self.stop_positions = stop_positions
+        # walking transfers between nearby bus stops
+        self.foot_offsets = foot_offsets
+        self.foot_targets = foot_targets
+        self.foot_times = foot_times
+        self.transfer = transfer
+
+    @classmethod
+    def build(cls, stop_df, registry, headways):
+        """
+        Build the route and stop arrays from the bus stop DataFrame of every service,
+        the bus stop registry and the service headways
+        """
+        speed = headways.get("speed", 20) / 3.6
+        dwell = headways.get("dwell", 0)
+        default = headways.get("default", {})
+        services = headways.get("services", {})
+
+        route_service = []
+        route_stops = []
+        route_times = []
+        route_departures = []
+        route_offsets = [0]
+        for key in sorted(stop_df):
+            timetable = dict(default, **services.get(key, {}))
+            if "departures" in timetable:
+                departures = np.sort(np.array([parse_time(t) for t in timetable["departures"]], dtype=np.float64))
+            else:
+                departures = np.arange(parse_time(timetable["first"]), parse_time(timetable["last"]) + 1,
+                                       timetable["headway"] * 60, dtype=np.float64)
+            df = stop_df[key]
+            for direction in sorted(set(df['direction'])):
+                rows = np.array([registry.row_of[int(code)] for code in df[df['direction'] == direction]['busCode']])
+                if len(rows) < 2:
+                    continue
+                # ride time between consecutive stops from the distance at the average bus speed, plus the dwell time
+                ride = haversine_array(registry.lat[rows[:-1]], registry.lon[rows[:-1]],
+                                       registry.lat[rows[1:]], registry.lon[rows[1:]]) / speed + dwell
+                route_service.append(key)
+                route_stops.append(rows)
+                route_times.append(np.concatenate(([0.0], np.cumsum(ride))))
+                route_departures.append(departures)
+                route_offsets.append(route_offsets[-1] + len(rows))
+        route_stops = np.concatenate(route_stops) if route_stops else np.zeros(0, dtype=np.int64)
+        route_times = np.concatenate(route_times) if route_times else np.zeros(0)
+        route_offsets = np.array(route_offsets, dtype=np.int64)
+
+        # stop -> (route, position) in CSR order
+        n = len(registry)
+        route_of_position = np.repeat(np.arange(len(route_service)), np.diff(route_offsets))
+        position = np.arange(len(route_stops)) - route_offsets[route_of_position]
+        order = np.lexsort((position, route_of_position, route_stops))
+        stop_route_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(route_stops, minlength=n), out=stop_route_offsets[1:])
+
+        # walking transfers between bus stops within the walk radius (opposite side of the road, next block),
+        # transitively closed: a chain of short walks is one transfer, so one relaxation per round finds every walk
+        walk_speed = headways.get("walk_speed", 1.2)
+        walk_radius = headways.get("walk_radius", 250)
+        distances = haversine_array(registry.lat[:, None], registry.lon[:, None], registry.lat[None, :], registry.lon[None, :])
+        # zero is no edge in the sparse matrix, stops at the same place are kept a millimetre apart
+        near = np.where(distances <= walk_radius, np.maximum(distances, 1e-3), 0)
+        np.fill_diagonal(near, 0)
+        distances = shortest_path(csr_matrix(near), directed=False)
+        np.fill_diagonal(distances, np.inf)
+        foot_sources, foot_targets = np.nonzero(np.isfinite(distances))
+        foot_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(foot_sources, minlength=n), out=foot_offsets[1:])
+
+        return cls(registry.codes, route_service, route_offsets, route_stops, route_times, route_departures,
+                   stop_route_offsets, route_of_position[order], position[order],
+                   foot_offsets, foot_targets, distances[foot_sources, foot_targets] / walk_speed,
+                   headways.get("transfer", 60))
+
+    def journeys(self, start, end, depart, max_trips=MAX_TRIPS):
+        """
+        Pareto optimal journeys from bus stop code start to bus stop code end leaving at depart (seconds after midnight)
+        Returns a list of Journey, fewest transfers first, empty if the end cannot be reached
+        A walk only journey (no bus leg) is returned when walking is faster than every bus
+        """
+        if start not in self.row_of or end not in self.row_of:
+            return []
+        return self.query({self.row_of[start]: depart}, {self.row_of[end]: 0}, max_trips)
+
+    def query(self, sources, targets, max_trips=MAX_TRIPS):
+        """
+        RAPTOR search from many stops to many stops
+        sources = {stop row: time the stop is reached}, targets = {stop row: seconds from the stop to the destination}
+        """
+        n = len(self.codes)
+        best = np.full(n, np.inf)
+        labels = [np.full(n, np.inf)]
+        parents = [{}]
+        for stop, time in sources.items():
+            labels[0][stop] = time
+            best[stop] = time
+        marked = self._footpaths(labels[0], best, parents[0], set(sources), np.inf)
+
+        results = []
+        target_best = min(labels[0][stop] + egress for stop, egress in targets.items())
+        for k in range(1, max_trips + 1):
+            if not marked:
+                break
+            previous = labels[k - 1]
+            current = np.full(n, np.inf)
+            parent = {}
+            # earliest marked position of every route serving a marked stop
+            queue = {}
+            for stop in marked:
+                for i in range(self.stop_route_offsets[stop], self.stop_route_offsets[stop + 1]):
+                    route, position = self.stop_routes[i], self.stop_positions[i]
+                    if position < queue.get(route, len(self.route_stops)):
+                        queue[route] = position
+            # changing buses takes time, the first bus is boarded as soon as the stop is reached
+            slack = self.transfer if k > 1 else 0
+
+            marked = set()
+            for route, first in queue.items():
+                begin, finish = self.route_offsets[route], self.route_offsets[route + 1]
+                stops = self.route_stops[begin:finish]
+                times = self.route_times[begin:finish]
+                departures = self.route_departures[route]
+                trip = None
+                board = None
+                for i in range(first, len(stops)):
+                    stop = stops[i]
+                    if trip is not None:
+                        arrival = trip + times[i]
+                        if arrival < best[stop] and arrival < target_best:
+                            current[stop] = arrival
+                            best[stop] = arrival
+                            parent[stop] = (route, board, i, trip)
+                            marked.add(stop)
+                    # catch an earlier trip of the route at this stop
+                    ready = previous[stop] + slack
+                    if ready < np.inf and (trip is None or ready <= trip + times[i]):
+                        j = np.searchsorted(departures, ready - times[i])
+                        if j < len(departures) and (trip is None or departures[j] < trip):
+                            trip = departures[j]
+                            board = i
+            marked = self._footpaths(current, best, parent, marked, target_best)
+            labels.append(current)
+            parents.append(parent)
+
+            arrival, stop = min((current[stop] + egress, stop) for stop, egress in targets.items())
+            if arrival < target_best:
+                target_best = arrival
+                results.append(Journey(arrival, k - 1, self._unwind(labels, parents, k, stop)))
+        if not results:
+            # no bus beats walking (or staying at the start), the journey walks all the way
+            arrival, stop = min((labels[0][stop] + egress, stop) for stop, egress in targets.items())
+            if arrival < np.inf:
+                results.append(Journey(arrival, 0, self._unwind(labels, parents, 0, stop)))
+        return results
+
+    def _footpaths(self, labels, best, parent, marked, target_best):
+        """
+        Relax the walking transfers out of every marked stop, return the marked stops including the ones reached on foot
+        The footpaths are transitively closed, so walks start only from the times the stops were reached
+        before this call and are never chained
+        """
+        reached = set(marked)
+        for stop, time in [(stop, labels[stop]) for stop in marked]:
+            for i in range(self.foot_offsets[stop], self.foot_offsets[stop + 1]):
+                target = self.foot_targets[i]
+                arrival = time + self.foot_times[i]
+                if arrival < best[target] and arrival < target_best:
+                    labels[target] = arrival
+                    best[target] = arrival
+                    parent[target] = stop
+                    reached.add(target)
+        return reached
+
+    def _unwind(self, labels, parents, k, stop):
+        """
+        Follow the parents back from the stop reached in round k, return the legs in travel order
+        """
+        legs = []
+        while True:
+            step = parents[k].get(stop)
+            if step is None:
+                break
+            if isinstance(step, tuple):
+                route, board, alight, trip = step
+                begin = self.route_offsets[route]
+                stops = self.route_stops[begin + board:begin + alight + 1]
+                legs.append(Leg(self.route_service[route], self.codes[stops].tolist(),
+                                trip + self.route_times[begin + board], trip + self.route_times[begin + alight]))
+                stop = stops[0]
+                k -= 1
+            else:
+                # walking transfer, the previous stop is reached in the same round
+                arrive = labels[k][stop]
+                legs.append(Leg(None, [int(self.codes[step]), int(self.codes[stop])], labels[k][step], arrive))
+                stop = step
+        legs.reverse()
+        return legs
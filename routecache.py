@@ -0,0 +1,92 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Memory budget of the cached routes in bytes
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+class RouteCache:
+    """
+    LRU cache of computed routes, keyed by (mode, snapped start node, snapped end node, options)
+    Values are the route and its GeoJSON, so a hit skips both the search and the GeoJSON build
+    Entries are kept in memory up to max_bytes (pickled size), least recently used first out
+    With a folder every entry is also written to disk and a memory miss is looked up there,
+    namespace should change whenever the graphs change so old disk entries are not reused
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, folder=None, namespace=""):
+        self.max_bytes = max_bytes
+        self.folder = folder
+        self.namespace = namespace
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # shared by the request threads of the flask server
+        self.lock = threading.Lock()
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr((self.namespace, key)).encode()).hexdigest()
+        return os.path.join(self.folder, digest + ".pkl")
+
+    def get(self, key):
+        """
+        Return the cached value of key, None on a miss
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if self.folder is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as f:
+                blob = f.read()
+            with self.lock:
+                self.disk_hits += 1
+                self._store(key, pickle.loads(blob), len(blob))
+                return self.entries.get(key)
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Cache value under key, evicting the least recently used entries over the memory budget
+        """
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.folder is not None:
+            # write then rename so a concurrent reader never sees half a file
+            path = self._path(key)
+            with open(path + ".tmp", 'wb') as f:
+                f.write(blob)
+            os.replace(path + ".tmp", path)
+        with self.lock:
+            self._store(key, value, len(blob))
+
+    def _store(self, key, value, size):
+        if key in self.entries:
+            self.bytes -= self.sizes[key]
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.sizes[key] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            old, _ = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(old)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Hit / miss counters and memory use
+        """
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.evictions, "entries": len(self.entries), "bytes": self.bytes}
@@ -0,0 +1,94 @@
+import json
+import numpy as np
+
+# Compact route payloads drawn by templates/map.html
+# A route is {"legs": [...], "markers": [...]} plus its distance / duration, every leg is one encoded polyline
+# (Google polyline algorithm, 5 decimals) and every marker a (lat, lon, mode, popup) of a station, stop, start or end
+
+
+def encode_polyline(points, precision=5):
+    """
+    Encoded polyline of a list of (lat, lon)
+    """
+    factor = 10 ** precision
+    encoded = []
+    previous = (0, 0)
+    for lat, lon in points:
+        current = (int(round(lat * factor)), int(round(lon * factor)))
+        for delta in (current[0] - previous[0], current[1] - previous[1]):
+            # zigzag the sign into the lowest bit, then 5 bits per character with a continuation bit
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        previous = current
+    return "".join(encoded)
+
+
+def leg_points(geojson):
+    """
+    (lat, lon) of the edges of a route GeoJSON string merged into one line
+    Edges stored the other way round (u, v swapped) are reversed so that the line is continuous
+    """
+    points = []
+    for feature in json.loads(geojson)["features"]:
+        if feature["geometry"] is None or feature["geometry"]["type"] != "LineString" or \
+                len(feature["geometry"]["coordinates"]) < 2:
+            continue
+        coordinates = [(lat, lon) for lon, lat in feature["geometry"]["coordinates"]]
+        if points and squared_distance(points[-1], coordinates[-1]) < squared_distance(points[-1], coordinates[0]):
+            coordinates.reverse()
+        if points and points[-1] == coordinates[0]:
+            coordinates = coordinates[1:]
+        points.extend(coordinates)
+    return points
+
+
+def line_geojson(coordinates):
+    """
+    GeoJSON feature collection string of one LineString of (lon, lat) coordinates, no feature if it has no length
+    """
+    return lines_geojson([coordinates])
+
+
+def lines_geojson(lines):
+    """
+    GeoJSON feature collection string of one LineString feature per line of (lon, lat) coordinates with a length
+    """
+    features = [{"type": "Feature", "properties": {},
+                 "geometry": {"type": "LineString", "coordinates": np.asarray(coordinates).tolist()}}
+                for coordinates in lines if len(coordinates) > 1]
+    return json.dumps({"type": "FeatureCollection", "features": features})
+
+
+def squared_distance(a, b):
+    """
+    Squared distance in degrees, only used to compare the ends of two edges
+    """
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2
+
+
+def route_leg(geojson, mode, service=None, **members):
+    """
+    One leg of a route payload, the edges of geojson as an encoded polyline
+    """
+    leg = {"mode": mode, "service": service, "polyline": encode_polyline(leg_points(geojson))}
+    leg.update(members)
+    return leg
+
+
+def marker(lat, lon, mode, popup):
+    """
+    One marker of a route payload, mode = station, stop, start or end
+    """
+    return {"lat": round(float(lat), 6), "lon": round(float(lon), 6), "mode": mode, "popup": popup}
+
+
+def route_payload(legs, markers, x1, y1, x2, y2, **members):
+    """
+    Route payload with its start and end markers, extra members (distance, duration...) at the top level
+    """
+    payload = {"legs": legs, "markers": markers + [marker(x1, y1, "start", "start"), marker(x2, y2, "end", "end")]}
+    payload.update(members)
+    return payload
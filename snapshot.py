@@ -0,0 +1,167 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely import wkb
+from graphindex import CSRGraph, DATA_FOLDER
+
+# Bump when the layout of the snapshot changes, older snapshots are rebuilt
+SNAPSHOT_VERSION = 2
+
+# Edge arrays stored besides the CSRGraph arrays, row i = row i of the osmnx edges GeoDataFrame
+EDGE_ARRAYS = ("edge_u", "edge_v", "edge_key", "edge_length",
+               "edge_wkb", "edge_wkb_offsets", "edge_coords", "edge_coord_offsets")
+
+
+def snapshot_path(filename, folder=DATA_FOLDER):
+    """
+    Snapshot is saved next to the graphml, walk.graphml -> walk.snapshot/
+    """
+    return os.path.join(folder, os.path.splitext(filename)[0] + ".snapshot")
+
+
+def _source_stamp(filename, folder):
+    graphml = os.path.join(folder, filename)
+    return {"version": SNAPSHOT_VERSION, "source": filename,
+            "mtime": os.path.getmtime(graphml), "size": os.path.getsize(graphml)}
+
+
+def build_snapshot(filename, folder=DATA_FOLDER):
+    """
+    Parse a graphml once and save it as a folder of .npy arrays:
+    the CSRGraph arrays, edge u / v / key / length, the WKB of every edge geometry and the node tags
+    """
+    import osmnx as ox
+
+    graph = ox.save_load.load_graphml(filename, folder=folder)
+    if graph.number_of_edges() > 0:
+        nodes, edges = ox.graph_to_gdfs(graph)
+    else:
+        nodes, edges = ox.graph_to_gdfs(graph, edges=False), None
+    index = CSRGraph(nodes, edges)
+
+    path = snapshot_path(filename, folder)
+    os.makedirs(path, exist_ok=True)
+    for name in CSRGraph.ARRAYS:
+        np.save(os.path.join(path, name + ".npy"), getattr(index, name))
+
+    # Edge geometry as one WKB byte blob plus the start offset of every edge
+    blobs = [] if edges is None else [wkb.dumps(geometry) for geometry in edges['geometry']]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    # Edge geometry again as the (lon, lat) of every point, edge i = edge_coords[offsets[i]:offsets[i + 1]]
+    coords = [] if edges is None else [np.asarray(geometry.coords)[:, :2] for geometry in edges['geometry']]
+    coord_offsets = np.zeros(len(coords) + 1, dtype=np.int64)
+    np.cumsum([len(points) for points in coords], out=coord_offsets[1:])
+    arrays = {
+        "edge_u": np.zeros(0, dtype=np.int64) if edges is None else edges['u'].values.astype(np.int64),
+        "edge_v": np.zeros(0, dtype=np.int64) if edges is None else edges['v'].values.astype(np.int64),
+        "edge_key": np.zeros(0, dtype=np.int64) if edges is None else edges['key'].values.astype(np.int64),
+        "edge_length": np.zeros(0) if edges is None else edges['length'].values.astype(np.float64),
+        "edge_wkb": np.frombuffer(b"".join(blobs), dtype=np.uint8),
+        "edge_wkb_offsets": offsets,
+        "edge_coords": np.concatenate(coords) if coords else np.zeros((0, 2)),
+        "edge_coord_offsets": coord_offsets,
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), array)
+
+    # Text tags of the nodes (bus stop code, station ref...) are small, keep them as json
+    tags = {}
+    for column in nodes.columns:
+        if column not in ("x", "y", "osmid", "geometry"):
+            tags[column] = [None if pd.isnull(value) else str(value) for value in nodes[column]]
+    meta = _source_stamp(filename, folder)
+    meta["tags"] = tags
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return path
+
+
+def load_snapshot(filename, folder=DATA_FOLDER):
+    """
+    Memory map the snapshot of a graphml, build it first if it is missing or out of date
+    """
+    path = snapshot_path(filename, folder)
+    meta_file = os.path.join(path, "meta.json")
+    stamp = _source_stamp(filename, folder)
+    meta = None
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+    if meta is None or any(meta.get(key) != value for key, value in stamp.items()):
+        build_snapshot(filename, folder)
+        with open(meta_file) as f:
+            meta = json.load(f)
+    return GraphSnapshot(path, meta)
+
+
+class GraphSnapshot:
+    """
+    Read only view of a graph snapshot, the arrays are memory mapped
+    so every process loading the same snapshot shares the same pages
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.tags = meta["tags"]
+        self.arrays = {}
+        for name in CSRGraph.ARRAYS + EDGE_ARRAYS:
+            self.arrays[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+
+    def index(self):
+        """
+        Return the CSRGraph of the snapshot
+        """
+        return CSRGraph.from_arrays(self.arrays)
+
+    def edge_geometry(self, row):
+        """
+        Return the shapely geometry of one edge row
+        """
+        offsets = self.arrays["edge_wkb_offsets"]
+        return wkb.loads(self.arrays["edge_wkb"][offsets[row]:offsets[row + 1]].tobytes())
+
+    def edge_line(self, rows):
+        """
+        (lon, lat) of the edge rows joined end to end into one line, gathered in one take
+        Every edge after the first starts where the previous one ends, that shared point is kept once
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return np.zeros((0, 2))
+        offsets = self.arrays["edge_coord_offsets"]
+        starts = offsets[rows] + (np.arange(len(rows)) > 0)
+        counts = offsets[rows + 1] - starts
+        # position of every point: start of its edge + its rank within the edge
+        ends = np.cumsum(counts)
+        positions = np.repeat(starts - ends + counts, counts) + np.arange(ends[-1])
+        return self.arrays["edge_coords"][positions]
+
+    def nodes_frame(self):
+        """
+        Return the nodes as a DataFrame indexed by osmid with x, y and the node tags
+        """
+        ids = np.asarray(self.arrays["ids"])
+        df = pd.DataFrame({"osmid": ids, "x": self.arrays["x"], "y": self.arrays["y"]}, index=ids)
+        for column, values in self.tags.items():
+            df[column] = values
+        return df
+
+    def edges_frame(self):
+        """
+        Return the edges as a GeoDataFrame (u, v, key, length, geometry) in the osmnx row order
+        """
+        rows = range(len(self.arrays["edge_u"]))
+        return gpd.GeoDataFrame({"u": self.arrays["edge_u"], "v": self.arrays["edge_v"],
+                                 "key": self.arrays["edge_key"], "length": self.arrays["edge_length"]},
+                                geometry=[self.edge_geometry(row) for row in rows], crs="EPSG:4326")
+
+
+if __name__ == "__main__":
+    # Build step: python snapshot.py [graphml ...], converts every graphml in data/ by default
+    import sys
+
+    for filename in sys.argv[1:] or sorted(f for f in os.listdir(DATA_FOLDER) if f.endswith(".graphml")):
+        print("Saved snapshot " + build_snapshot(filename))
@@ -0,0 +1,98 @@
+from collections import namedtuple
+import numpy as np
+from scipy.spatial import cKDTree
+from shapely.affinity import affine_transform
+from shapely.geometry import Point
+from shapely.strtree import STRtree
+from graphindex import EARTH_RADIUS
+
+# Result of SpatialIndex.snap, one entry per input point
+# nodes = osmid of the nearest node, edges = row of the nearest edge in the snapshot edges (-1 for graphs without edges,
+# None unless the edges were asked for), distances are in metres
+Snap = namedtuple("Snap", ["nodes", "node_distances", "edges", "edge_distances"])
+
+
+class SpatialIndex:
+    """
+    Nearest node / nearest edge index of a graph snapshot
+    Coordinates are projected to metres around the centre of the graph (equirectangular, accurate at Punggol scale),
+    nodes are kept in a KD-tree and edge geometries in an STRtree, built on the first nearest edge query
+    Build it once per graph and share it with every query
+    """
+
+    def __init__(self, snapshot):
+        arrays = snapshot.arrays
+        self.ids = np.asarray(arrays["ids"])
+        # metres per degree of longitude / latitude around the centre of the graph
+        lat0 = np.radians(float(np.mean(arrays["y"])))
+        self.kx = np.radians(1) * EARTH_RADIUS * np.cos(lat0)
+        self.ky = np.radians(1) * EARTH_RADIUS
+
+        self.node_tree = cKDTree(np.column_stack(self.project(arrays["y"], arrays["x"])))
+
+        # (projected edge geometries, STRtree, {id(geometry): edge row}), decoding every edge WKB is only paid
+        # by the graphs whose edges are snapped to
+        self.snapshot = snapshot
+        self.edges = None
+
+    def edge_index(self):
+        """
+        Return the projected edge geometries, their STRtree (None for graphs without edges) and the row of every geometry
+        Built on first use and published in one assignment, so threads sharing the index never see half of it
+        """
+        edges = self.edges
+        if edges is None:
+            geometries = [affine_transform(self.snapshot.edge_geometry(row), [self.kx, 0, 0, self.ky, 0, 0])
+                          for row in range(len(self.snapshot.arrays["edge_u"]))]
+            # shapely < 2 returns geometries instead of indices from the tree
+            edges = self.edges = (geometries, STRtree(geometries) if geometries else None,
+                                  {id(geometry): row for row, geometry in enumerate(geometries)})
+        return edges
+
+    def project(self, lat, lon):
+        """
+        Project latitude / longitude arrays to metres
+        """
+        return np.asarray(lon, dtype=np.float64) * self.kx, np.asarray(lat, dtype=np.float64) * self.ky
+
+    def nearest_nodes(self, lat, lon):
+        """
+        Return (dense ids, distances in metres) of the nearest node of every point
+        """
+        distances, nodes = self.node_tree.query(np.column_stack(self.project(lat, lon)))
+        return nodes, distances
+
+    def nearest_edges(self, lat, lon):
+        """
+        Return (edge rows, distances in metres) of the nearest edge of every point
+        """
+        px, py = self.project(lat, lon)
+        rows = np.full(len(px), -1, dtype=np.int64)
+        distances = np.full(len(px), np.inf)
+        geometries, edge_tree, edge_row = self.edge_index()
+        if edge_tree is None:
+            return rows, distances
+        points = [Point(x, y) for x, y in zip(px, py)]
+        if hasattr(edge_tree, "query_nearest"):
+            (point_rows, edge_rows), edge_distances = edge_tree.query_nearest(
+                points, return_distance=True, all_matches=False)
+            rows[point_rows] = edge_rows
+            distances[point_rows] = edge_distances
+        else:
+            for i, point in enumerate(points):
+                geometry = edge_tree.nearest(point)
+                rows[i] = edge_row[id(geometry)]
+                distances[i] = geometry.distance(point)
+        return rows, distances
+
+    def snap(self, points, edges=False):
+        """
+        Snap many (lat, lon) points to the graph in one call
+        Return a Snap of node osmids, node distances and, if edges, edge rows and edge distances
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        nodes, node_distances = self.nearest_nodes(points[:, 0], points[:, 1])
+        if not edges:
+            return Snap(self.ids[nodes], node_distances, None, None)
+        edge_rows, edge_distances = self.nearest_edges(points[:, 0], points[:, 1])
+        return Snap(self.ids[nodes], node_distances, edge_rows, edge_distances)
@@ -0,0 +1,125 @@
+import glob
+import os
+import numpy as np
+import pandas as pd
+from shapely import wkt
+
+# One csv file per LRT line, MRT/MRT-EAST.csv is the "east" line
+# Every row is the track between two adjacent stations: u, v (station osmids), "description" ("From - To"), length, geometry
+LRT_LINE_GLOB = 'MRT/MRT-*.csv'
+
+
+def line_files(pattern=LRT_LINE_GLOB):
+    """
+    {line name: csv file} of every LRT line file
+    """
+    return {os.path.splitext(os.path.basename(filename))[0].split("-", 1)[1].lower(): filename
+            for filename in sorted(glob.glob(pattern))}
+
+
+class StationRegistry:
+    """
+    Single lookup table of every LRT station keyed by osmid, and of the track between adjacent stations
+    Stations: name, ref, latitude / longitude and the lines they are on
+    Segments: u, v, line, length in metres and (lon, lat) points of the track, all points in one array
+    Built from the line csv files and the station nodes of mrt.graphml, a new station or line only needs new rows / files
+    """
+
+    def __init__(self, osmids, names, refs, lat, lon, lines, segment_u, segment_v, segment_line, segment_length,
+                 segment_coords, segment_offsets):
+        self.osmids = np.asarray(osmids, dtype=np.int64)
+        self.names = list(names)
+        self.refs = list(refs)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lines = [list(station_lines) for station_lines in lines]
+        self.segment_u = np.asarray(segment_u, dtype=np.int64)
+        self.segment_v = np.asarray(segment_v, dtype=np.int64)
+        self.segment_line = list(segment_line)
+        self.segment_length = np.asarray(segment_length, dtype=np.float64)
+        self.segment_coords = np.asarray(segment_coords, dtype=np.float64).reshape(-1, 2)
+        self.segment_offsets = np.asarray(segment_offsets, dtype=np.int64)
+        # osmid -> row
+        self.row_of = {osmid: row for row, osmid in enumerate(self.osmids.tolist())}
+        # (u, v) -> segment, either way round
+        self.segment_of = {}
+        for segment, (u, v) in enumerate(zip(self.segment_u.tolist(), self.segment_v.tolist())):
+            self.segment_of[(u, v)] = segment
+            self.segment_of[(v, u)] = segment
+
+    @classmethod
+    def build(cls, nodes_df, files=None):
+        """
+        Build the registry from the station nodes of mrt.graphml (osmid, x, y, ref) and the line csv files
+        Station names come from the "From - To" descriptions of the segments
+        """
+        files = line_files() if files is None else files
+        names = {}
+        lines = {}
+        segments = []
+        for line, filename in sorted(files.items()):
+            df = pd.read_csv(filename, encoding='utf-8-sig')
+            df.columns = [column.strip() for column in df.columns]
+            for u, v, description, length, geometry in zip(df['u'], df['v'], df['description'], df['length'],
+                                                            df['geometry']):
+                u, v = int(u), int(v)
+                ends = [name.strip() for name in str(description).split(" - ")]
+                # a station keeps the first name found, the name of the v end first (e.g. "Sam Kee" before "Sam kee")
+                if len(ends) == 2:
+                    names.setdefault(v, ends[1])
+                    names.setdefault(u, ends[0])
+                for station in (u, v):
+                    lines.setdefault(station, [])
+                    if line not in lines[station]:
+                        lines[station].append(line)
+                segments.append((u, v, line, float(length), np.asarray(wkt.loads(geometry).coords)[:, :2]))
+
+        nodes = nodes_df.set_index('osmid')
+        osmids = sorted(lines)
+        missing = [osmid for osmid in osmids if osmid not in nodes.index]
+        if missing:
+            raise ValueError("LRT stations missing in mrt.graphml: " + ", ".join(str(osmid) for osmid in missing))
+        offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+        np.cumsum([len(segment[4]) for segment in segments], out=offsets[1:])
+        return cls(osmids, [names.get(osmid, str(osmid)) for osmid in osmids],
+                   [nodes.loc[osmid, 'ref'] if 'ref' in nodes.columns else None for osmid in osmids],
+                   [nodes.loc[osmid, 'y'] for osmid in osmids], [nodes.loc[osmid, 'x'] for osmid in osmids],
+                   [lines[osmid] for osmid in osmids],
+                   [segment[0] for segment in segments], [segment[1] for segment in segments],
+                   [segment[2] for segment in segments], [segment[3] for segment in segments],
+                   np.concatenate([segment[4] for segment in segments]) if segments else np.zeros((0, 2)), offsets)
+
+    def __contains__(self, osmid):
+        return int(osmid) in self.row_of
+
+    def __len__(self):
+        return len(self.osmids)
+
+    def coords(self, osmid):
+        """
+        Return (latitude, longitude) of a station osmid
+        """
+        row = self.row_of[int(osmid)]
+        return self.lat[row], self.lon[row]
+
+    def get_name(self, osmid):
+        return self.names[self.row_of[int(osmid)]]
+
+    def get_lines(self, osmid):
+        return self.lines[self.row_of[int(osmid)]]
+
+    def segment_points(self, segment):
+        """
+        (lon, lat) of the track of a segment, from u to v
+        """
+        return self.segment_coords[self.segment_offsets[segment]:self.segment_offsets[segment + 1]]
+
+    def track(self, u, v):
+        """
+        (lon, lat) of the track from station u to the adjacent station v, None if they are not adjacent
+        """
+        segment = self.segment_of.get((int(u), int(v)))
+        if segment is None:
+            return None
+        points = self.segment_points(segment)
+        return points if self.segment_u[segment] == int(u) else points[::-1]